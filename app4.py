@@ -1,15 +1,39 @@
 import os
 import uuid
-import shutil
 import cv2
 import numpy as np
 import pandas as pd
+import openpyxl
 import requests
+import requests.adapters
 import re
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from ultralytics import YOLO
+import queue
+import random
+import time
+import threading
+import csv
+import json
+import sqlite3
+import hashlib
+import itertools
+import multiprocessing
+import zipfile
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 import pymysql # DIUBAH: Menggunakan library pymysql yang sudah terbukti bekerja
 import pymysql.cursors # DIUBAH: Diperlukan untuk mengambil data sebagai dictionary
+from inference_workers import InferencePool, stage_outputs
+from model_server import ModelServerClient
+# Konfigurasi dan fungsi model diimpor ulang di sini agar tetap bisa dipakai sebagai app4.<nama>
+# (benchmark.py, quantize_models.py, reprocess.py)
+from kwh_models import (
+    INFERENCE_BATCH_SIZE, MODEL_PATHS, INFERENCE_BACKEND, INFERENCE_PRECISION, INFERENCE_PROFILE_FILE,
+    MODEL_PROFILES, QUANTIZATION_CONFIG, INFERENCE_WORKERS_CONFIG, MODEL_SERVER_CONFIG,
+    exported_model_path, quantized_model_path, load_quantization_manifest, load_inference_profiles,
+    predict_kwargs, prepare_model_artifact, load_model, load_cascade_models, inference_worker_spec,
+    file_sha256, stage_fingerprints, model_version,
+)
 
 # ==============================================================================
 # KONFIGURASI & INISIALISASI
@@ -21,6 +45,10 @@ os.makedirs("static/results", exist_ok=True)
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("static/originals", exist_ok=True)  # Tambahan untuk folder originals
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# File pelanggan job bulk menunggu di-parse di JOB_EXECUTOR; sengaja di luar UPLOAD_FOLDER karena
+# /api/cleanup_uploads (dipanggil saat modal hasil ditutup) mengosongkan folder itu
+JOB_UPLOAD_FOLDER = os.path.join('cache', 'job_uploads')
+os.makedirs(JOB_UPLOAD_FOLDER, exist_ok=True)
 
 # Konfigurasi DB tidak perlu diubah, karena sudah terbukti benar
 DB_CONFIG = {
@@ -30,6 +58,246 @@ DB_CONFIG = {
     'database': 'kwh_detection'
 }
 
+# Pool koneksi database yang dipakai bersama oleh semua route dan pipeline.
+# Koneksi idle lebih dari ping_interval detik di-ping sebelum dipakai, lebih dari idle_timeout ditutup.
+DB_POOL_CONFIG = {
+    'size': 10,
+    'idle_timeout': 300,
+    'ping_interval': 30,
+    'acquire_timeout': 30,
+}
+
+# Download paralel ke portal ACMT diatur otomatis (AIMD) antara min_parallel dan max_parallel.
+# max_parallel juga menjadi ukuran connection pool keep-alive dan jumlah worker download.
+# latency_tolerance: kelipatan latensi baseline yang dianggap tanda portal mulai kewalahan.
+# Error sementara (timeout, 5xx, 429) diulang max_retries kali dengan exponential backoff + jitter;
+# circuit breaker menjeda semua download bila rasio error di breaker_window request terakhir
+# mencapai breaker_error_rate (jeda breaker_cooldown detik, berlipat ganda hingga breaker_max_cooldown).
+FETCH_CONFIG = {
+    'max_parallel': 16,
+    'initial_parallel': 4,
+    'min_parallel': 1,
+    'latency_tolerance': 2.0,
+    'decrease_factor': 0.5,
+    'timeout': 15,
+    'max_retries': 3,
+    'backoff_base': 1.0,
+    'backoff_max': 30.0,
+    'breaker_window': 50,
+    'breaker_min_requests': 20,
+    'breaker_error_rate': 0.5,
+    'breaker_cooldown': 30.0,
+    'breaker_max_cooldown': 300.0,
+}
+
+# Hasil deteksi ditulis ke database per batch: flush setiap batch_size baris atau flush_interval detik
+DB_WRITE_CONFIG = {
+    'batch_size': 200,
+    'flush_interval': 2.0,
+}
+
+# Ukuran halaman /api/view_database (keyset pagination)
+VIEW_PAGE_CONFIG = {
+    'default_limit': 100,
+    'max_limit': 1000,
+}
+
+# Cache hasil parsing file pelanggan (kolumnar .npz, kunci = hash isi file), eviksi LRU berdasarkan ukuran total
+WORKBOOK_CACHE_CONFIG = {
+    'directory': 'cache/workbooks',
+    'max_bytes': 512 * 1024 * 1024,
+    'chunk_rows': 50000,
+}
+# Naikkan bila aturan normalisasi IDPEL/SAHLWBP berubah agar cache lama tidak dipakai
+WORKBOOK_CACHE_VERSION = 1
+
+# Cache keluaran per tahap kaskade (kunci = SHA-256 isi foto + tahap + sidik model tahap itu),
+# disimpan di satu file SQLite dengan eviksi LRU berdasarkan ukuran halaman yang terpakai. Foto
+# yang sama (download ulang dari ACMT atau upload ulang) tidak diinferensi lagi, dan mengganti
+# satu model hanya menjalankan ulang tahap yang terdampak. Waktu akses entri hanya diperbarui
+# bila lebih tua dari touch_seconds, agar cache hit tidak selalu berarti tulis ke disk.
+STAGE_CACHE_CONFIG = {
+    'enabled': True,
+    'path': 'cache/stages.sqlite3',
+    'max_bytes': 256 * 1024 * 1024,
+    'touch_seconds': 600,
+}
+
+# Job bulk asinkron (/api/jobs): jumlah job yang berjalan bersamaan, lama status job disimpan
+# setelah selesai, dan interval status/heartbeat pada stream hasil. Proses yang menjalankan job
+# memperbarui UPDATED_AT di bulk_jobs setiap heartbeat_seconds (lease); job queued/running yang
+# lease-nya lebih tua dari lease_seconds dianggap 'interrupted' (prosesnya mati) oleh worker lain.
+# replay_results: jumlah hasil per item terakhir yang disimpan di memori untuk stream (?from=);
+# hasil yang lebih lama tetap ada di bulk_job_items, tetapi stream dari posisi itu hanya berisi status.
+JOB_CONFIG = {
+    'max_concurrent_jobs': 2,
+    'retention_seconds': 6 * 3600,
+    'heartbeat_seconds': 5,
+    'lease_seconds': 30,
+    'replay_results': 2000,
+}
+
+# Konfigurasi model (MODEL_PATHS, backend, presisi, profil inferensi, kuantisasi, proses worker
+# inferensi, dan model server) ada di kwh_models.py, yang juga dipakai model_server.py.
+# Autotune profil (benchmark.py --autotune): kandidat imgsz yang dicoba per tahap dan
+# penurunan akurasi SAI maksimum dibanding profil awal
+AUTOTUNE_CONFIG = {
+    'imgsz_candidates': [160, 224, 256, 320, 416, 480, 640],
+    'max_accuracy_drop': 0.01,
+    'sample_rows': 300,
+}
+# Jumlah IDPEL per query IN (...) saat mengecek data yang sudah ada di database
+DB_LOOKUP_CHUNK_SIZE = 1000
+
+# Jumlah worker dan kedalaman antrean untuk pipeline download -> inferensi -> database
+PIPELINE_CONFIG = {
+    'inference_workers': 1,
+    'db_writers': 1,
+    'download_queue_size': 64,
+    'inference_queue_size': 32,
+    'db_queue_size': 64,
+}
+
+# Proses ulang foto di static/originals/<ket> (reprocess.py dan /api/reprocess): jumlah thread
+# pembaca file dan worker inferensi (decode dan render berjalan paralel; tanpa proses worker
+# inferensi, forward pass tetap bergantian lewat MODEL_LOCK)
+REPROCESS_CONFIG = {
+    'readers': 4,
+    'inference_workers': 2,
+}
+
+# ==============================================================================
+# MIGRASI SKEMA DATABASE (BERVERSI)
+# ==============================================================================
+# Perubahan skema TIDAK lagi dilakukan dengan mengedit CREATE TABLE, tetapi dengan menambahkan
+# migrasi baru di akhir SCHEMA_MIGRATIONS. Migrasi yang sudah dirilis jangan diubah.
+# Setiap langkah berupa string SQL atau fungsi yang menerima cursor.
+
+def _index_exists(cursor, table, index_name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1
+    """, (table, index_name))
+    return cursor.fetchone() is not None
+
+def _column_exists(cursor, table, column_name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s LIMIT 1
+    """, (table, column_name))
+    return cursor.fetchone() is not None
+
+def add_index_online(table, index_name, columns):
+    # Tambah index tanpa mengunci tabel (online DDL InnoDB); dilewati bila index sudah ada
+    def step(cursor):
+        if not _index_exists(cursor, table, index_name):
+            cursor.execute(f"ALTER TABLE {table} ADD INDEX {index_name} ({columns}), ALGORITHM=INPLACE, LOCK=NONE")
+    return step
+
+def add_column_online(table, column_name, definition):
+    # Tambah kolom secara INSTANT (MySQL 8.0.12+), fallback ke INPLACE tanpa lock; dilewati bila sudah ada
+    def step(cursor):
+        if _column_exists(cursor, table, column_name):
+            return
+        try:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column_name} {definition}, ALGORITHM=INSTANT")
+        except pymysql.err.MySQLError:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column_name} {definition}, ALGORITHM=INPLACE, LOCK=NONE")
+    return step
+
+SCHEMA_MIGRATIONS = [
+    (1, "Tabel kwh_detection", [
+        """
+        CREATE TABLE IF NOT EXISTS kwh_detection (
+            BLTH VARCHAR(6) NOT NULL,
+            IDPEL VARCHAR(20) NOT NULL,
+            KET VARCHAR(50) DEFAULT NULL,
+            SAHLWBP VARCHAR(20) DEFAULT NULL,
+            SAI VARCHAR(20) DEFAULT NULL,
+            ANOTASI VARCHAR(255) DEFAULT NULL,
+            VER VARCHAR(10) DEFAULT NULL,
+            PRIMARY KEY (BLTH, IDPEL)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+        """,
+    ]),
+    (2, "Index filter verifikasi dan keterangan per BLTH", [
+        add_index_online('kwh_detection', 'idx_ver_blth', 'VER, BLTH'),
+        add_index_online('kwh_detection', 'idx_ket_blth', 'KET, BLTH'),
+    ]),
+    (3, "Tabel checkpoint job bulk (bulk_jobs, bulk_job_items)", [
+        """
+        CREATE TABLE IF NOT EXISTS bulk_jobs (
+            JOB_ID CHAR(32) NOT NULL,
+            STATUS VARCHAR(20) NOT NULL,
+            BLTH_LIST TEXT NOT NULL,
+            POOL_ACMT VARCHAR(50) DEFAULT NULL,
+            TOTAL INT NOT NULL DEFAULT 0,
+            CURSOR_SEQ INT NOT NULL DEFAULT -1,
+            ERROR VARCHAR(255) DEFAULT NULL,
+            CREATED_AT TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UPDATED_AT TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (JOB_ID)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bulk_job_items (
+            JOB_ID CHAR(32) NOT NULL,
+            SEQ INT NOT NULL,
+            BLTH VARCHAR(6) NOT NULL,
+            IDPEL VARCHAR(20) NOT NULL,
+            SAHLWBP VARCHAR(20) DEFAULT NULL,
+            STATUS VARCHAR(10) NOT NULL DEFAULT 'pending',
+            RESULT_TEXT VARCHAR(255) DEFAULT NULL,
+            PRIMARY KEY (JOB_ID, SEQ),
+            KEY idx_job_status_seq (JOB_ID, STATUS, SEQ)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+        """,
+    ]),
+    (4, "Kolom MODEL_VERSION (versi model yang menghasilkan SAI/KET/ANOTASI)", [
+        add_column_online('kwh_detection', 'MODEL_VERSION', 'VARCHAR(16) DEFAULT NULL'),
+    ]),
+]
+
+def run_migrations(conn):
+    """
+    Menjalankan migrasi yang belum tercatat di tabel schema_migrations, berurutan per versi.
+    GET_LOCK mencegah beberapa worker menjalankan migrasi yang sama bersamaan saat startup.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT NOT NULL PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+        """)
+        cursor.execute("SELECT GET_LOCK('kwh_detection_migrations', 300)")
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("Gagal mendapatkan lock migrasi database.")
+        try:
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+            for version, description, steps in SCHEMA_MIGRATIONS:
+                if version in applied:
+                    continue
+                print(f"🔧 Menjalankan migrasi {version}: {description}...")
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description))
+                conn.commit()
+                print(f"✅ Migrasi {version} selesai.")
+            current = max([version for version, _, _ in SCHEMA_MIGRATIONS] + list(applied))
+            print(f"✅ Skema database pada versi {current}.")
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('kwh_detection_migrations')")
+            cursor.fetchone()
+    finally:
+        cursor.close()
+
 # ==============================================================================
 # FUNGSI INISIALISASI DATABASE OTOMATIS (MENGGUNAKAN PyMySQL)
 # ==============================================================================
@@ -50,25 +318,11 @@ def initialize_database():
         conn_server.close()
 
         conn_db = pymysql.connect(**DB_CONFIG) # DIUBAH
-        cursor_db = conn_db.cursor()
 
-        print(f"🔧 Memeriksa keberadaan tabel 'kwh_detection'...")
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS kwh_detection (
-            BLTH VARCHAR(6) NOT NULL,
-            IDPEL VARCHAR(20) NOT NULL,
-            KET VARCHAR(50) DEFAULT NULL,
-            SAHLWBP VARCHAR(20) DEFAULT NULL,
-            SAI VARCHAR(20) DEFAULT NULL,
-            ANOTASI VARCHAR(255) DEFAULT NULL,
-            VER VARCHAR(10) DEFAULT NULL,
-            PRIMARY KEY (BLTH, IDPEL)
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
-        """
-        cursor_db.execute(create_table_query)
+        print(f"🔧 Memeriksa skema database...")
+        run_migrations(conn_db)
         print("✅ Tabel 'kwh_detection' sudah siap.")
         
-        cursor_db.close()
         conn_db.close()
         print("🎉 Inisialisasi database berhasil!")
 
@@ -80,23 +334,137 @@ def initialize_database():
 # FUNGSI KONEKSI DATABASE & PEMUATAN MODEL
 # ==============================================================================
 
+class PooledConnection:
+    """
+    Pembungkus koneksi dari DBConnectionPool. Semua atribut diteruskan ke koneksi PyMySQL
+    aslinya, hanya close() yang mengembalikan koneksi ke pool alih-alih menutupnya.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class DBConnectionPool:
+    """
+    Pool koneksi PyMySQL yang aman dipakai banyak thread. Koneksi idle dipakai ulang;
+    koneksi yang idle lebih dari ping_interval di-ping (reconnect bila putus), dan yang
+    idle lebih dari idle_timeout ditutup. Bila semua koneksi sedang dipakai, pemanggil
+    menunggu hingga acquire_timeout detik.
+    """
+
+    def __init__(self, db_config, size, idle_timeout, ping_interval, acquire_timeout):
+        self.db_config = db_config
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = []  # list of (conn, waktu_dikembalikan)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _take_idle(self):
+        # Ambil koneksi idle terbaru; tutup yang sudah melewati idle_timeout
+        now = time.monotonic()
+        with self._lock:
+            expired = [conn for conn, returned_at in self._idle if now - returned_at > self.idle_timeout]
+            self._idle = [(conn, returned_at) for conn, returned_at in self._idle if now - returned_at <= self.idle_timeout]
+            item = self._idle.pop() if self._idle else None
+        for conn in expired:
+            self._close_quietly(conn)
+        return item
+
+    def connection(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise pymysql.err.OperationalError(f"Pool koneksi database penuh ({self.size} koneksi sedang dipakai).")
+        try:
+            item = self._take_idle()
+            if item is not None:
+                conn, returned_at = item
+                if time.monotonic() - returned_at > self.ping_interval:
+                    try:
+                        conn.ping(reconnect=True)
+                    except Exception:
+                        self._close_quietly(conn)
+                        conn = pymysql.connect(**self.db_config)
+            else:
+                conn = pymysql.connect(**self.db_config)
+            return PooledConnection(self, conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        try:
+            # Akhiri transaksi yang mungkin masih terbuka agar pemakai berikutnya tidak melihat snapshot lama
+            conn.rollback()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        except Exception:
+            self._close_quietly(conn)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+DB_POOL = DBConnectionPool(DB_CONFIG, **DB_POOL_CONFIG)
+
 def get_db_connection():
+    # Koneksi diambil dari DB_POOL; conn.close() mengembalikannya ke pool
     try:
-        conn = pymysql.connect(**DB_CONFIG) # DIUBAH
-        return conn
+        return DB_POOL.connection()
     except Exception as e:
         print(f"❌ Gagal koneksi database: {e}")
         raise
 
+MODEL_LOCK = threading.Lock()
+
+# Tool yang memuat modelnya sendiri (benchmark.py, quantize_models.py) mengisi env ini sebelum
+# mengimpor app4, agar model global tidak ikut dimuat (dan tidak ikut terhitung di peak RSS)
+SKIP_MODEL_LOAD = os.environ.get('KWH_SKIP_MODEL_LOAD') == '1'
+
+INFERENCE_POOL = None
+kwh_model = stand_model = ocr_model = None
 try:
-    print("Memuat model AI...")
-    kwh_model = YOLO('model/kwh.pt')
-    stand_model = YOLO('model/stand.pt')
-    ocr_model = YOLO('model/ocr.pt')
-    print("✅ Semua model AI berhasil dimuat.")
-    MODELS_LOADED = True
+    STAGE_FINGERPRINTS = stage_fingerprints()
+    MODEL_VERSION = model_version(STAGE_FINGERPRINTS)
+    if SKIP_MODEL_LOAD:
+        print(f"ℹ️ Model global tidak dimuat (KWH_SKIP_MODEL_LOAD=1, versi model {MODEL_VERSION}).")
+    else:
+        print(f"Memuat model AI (backend: {INFERENCE_BACKEND}, presisi: {INFERENCE_PRECISION})...")
+        if MODEL_SERVER_CONFIG['socket_path']:
+            # Model dipegang model_server.py (jalankan dengan kwh_models.py yang sama)
+            INFERENCE_POOL = ModelServerClient(MODEL_SERVER_CONFIG['socket_path'], STAGE_FINGERPRINTS, MODEL_SERVER_CONFIG['timeout'])
+            print(f"✅ Inferensi lewat model server di {MODEL_SERVER_CONFIG['socket_path']}.")
+        elif INFERENCE_WORKERS_CONFIG['processes'] <= 0:
+            kwh_model, stand_model, ocr_model = load_cascade_models()
+        elif multiprocessing.parent_process() is None:  # Worker dengan start method spawn ikut mengimpor modul ini
+            INFERENCE_POOL = InferencePool(inference_worker_spec(), INFERENCE_WORKERS_CONFIG['processes'], INFERENCE_WORKERS_CONFIG['torch_threads'], INFERENCE_WORKERS_CONFIG['start_timeout'])
+            print(f"✅ {INFERENCE_POOL.processes} proses worker inferensi berjalan ({INFERENCE_WORKERS_CONFIG['torch_threads']} thread torch per worker).")
+        print(f"✅ Semua model AI berhasil dimuat (versi model {MODEL_VERSION}, sidik tahap: {STAGE_FINGERPRINTS}).")
+    MODELS_LOADED = not SKIP_MODEL_LOAD
 except Exception as e:
     print(f"❌ Error saat memuat model AI: {e}")
+    STAGE_FINGERPRINTS = None
+    MODEL_VERSION = None
     MODELS_LOADED = False
 
 # ==============================================================================
@@ -104,69 +472,114 @@ except Exception as e:
 # FUNGSI INTI PEMROSESAN GAMBAR (LOGIKA AI)
 # ==============================================================================
 
-def process_single_image(image_path, save_to_results=False):
-    # ... (Fungsi ini tidak berubah)
-    if not MODELS_LOADED:
-        return None, "Error: Model AI tidak berhasil dimuat.", None, None, None
-    try:
-        img = cv2.imread(image_path)
-        if img is None: return None, "Gagal membaca file gambar.", None, None, None
-    except Exception as e:
-        return None, f"Error saat membaca gambar: {e}", None, None, None
+def _run_model_batched(model, images, stage, stage_timings=None):
+    # Jalankan model untuk banyak gambar sekaligus, dipotong per INFERENCE_BATCH_SIZE.
+    # Bila stage_timings diberikan, durasi per gambar (detik) ditambahkan ke stage_timings[stage].
+    kwargs = predict_kwargs(stage)
+    results = []
+    for start in range(0, len(images), INFERENCE_BATCH_SIZE):
+        chunk = images[start:start + INFERENCE_BATCH_SIZE]
+        started = time.perf_counter()
+        with MODEL_LOCK:  # Objek model YOLO tidak thread-safe, forward pass dijalankan bergantian
+            results.extend(model(chunk, **kwargs))
+        if stage_timings is not None:
+            per_image = (time.perf_counter() - started) / len(chunk)
+            stage_timings.setdefault(stage, []).extend([per_image] * len(chunk))
+    return results
+
+def detect_batch(images, models=None, stage_timings=None, image_keys=None):
+    """
+    Menjalankan kaskade kwh -> stand -> ocr untuk banyak gambar sekaligus.
+    Setiap tahap hanya menerima gambar yang lolos tahap sebelumnya: hanya 'kwh_jelas'
+    yang masuk ke model stand, dan hanya stand yang terdeteksi yang masuk ke OCR.
+    Bila image_keys diberikan (dan memakai model global), keluaran tiap tahap diambil dari
+    STAGE_CACHE bila ada; model hanya dijalankan untuk gambar yang belum ada di cache tahap itu.
+    Dengan model global dan INFERENCE_POOL aktif (InferencePool atau ModelServerClient), setiap
+    tahap dijalankan di proses worker atau model server.
+
+    Args:
+        models (tuple, optional): (kwh_model, stand_model, ocr_model); default model global.
+        stage_timings (dict, optional): Diisi latensi per gambar per tahap ('kwh', 'stand', 'ocr').
+        image_keys (list, optional): Hasil image_cache_key per gambar (None = tanpa cache).
+
+    Returns:
+        list[dict]: Satu dict deteksi per gambar, urutannya sama dengan input.
+    """
+    cascade = dict(zip(('kwh', 'stand', 'ocr'), models or (kwh_model, stand_model, ocr_model)))
+    use_pool = models is None and INFERENCE_POOL is not None
+    use_cache = image_keys is not None and models is None
+    detections = [{'kwh_status': 'bukan_kwh', 'kwh_conf': 0.0, 'kwh_box': None,
+                   'stand_box': None, 'stand_conf': 0.0, 'digits': []} for _ in images]
+
+    def compute(stage, stage_images):
+        # list dict keluaran tahap (format inference_workers.stage_outputs), per gambar
+        if not use_pool:
+            model = cascade[stage]
+            return stage_outputs(stage, model.names, _run_model_batched(model, stage_images, stage, stage_timings))
+        started = time.perf_counter()
+        outputs = INFERENCE_POOL.run_stage(stage, stage_images)
+        if stage_timings is not None and stage_images:
+            per_image = (time.perf_counter() - started) / len(stage_images)
+            stage_timings.setdefault(stage, []).extend([per_image] * len(stage_images))
+        return outputs
+
+    def run_stage(stage, indices, stage_input):
+        # stage_input(i) -> gambar input tahap untuk gambar ke-i; hasilnya digabung ke detections
+        outputs = {}
+        if use_cache:
+            for i in indices:
+                cached = get_cached_stage(stage, image_keys[i])
+                if cached is not None:
+                    outputs[i] = cached
+        misses = [i for i in indices if i not in outputs]
+        if misses:
+            for i, output in zip(misses, compute(stage, [stage_input(i) for i in misses])):
+                outputs[i] = output
+                if use_cache:
+                    store_cached_stage(stage, image_keys[i], output)
+        for i in indices:
+            detections[i].update(outputs[i])
+
+    run_stage('kwh', list(range(len(images))), lambda i: images[i])
+    jelas_idx = [i for i, det in enumerate(detections) if det['kwh_status'] == 'kwh_jelas']
+    run_stage('stand', jelas_idx, lambda i: images[i])
+    ocr_idx = [i for i in jelas_idx if detections[i]['stand_box'] is not None and _stand_roi(images[i], detections[i]).size > 0]
+    run_stage('ocr', ocr_idx, lambda i: _stand_roi(images[i], detections[i]))
+    return detections
+
+def _stand_roi(img, det):
+    sx1, sy1, sx2, sy2 = det['stand_box']
+    return img[sy1:sy2, sx1:sx2]
+
+def digits_to_sai(digits):
+    # Angka stand: 5 digit dengan confidence tertinggi, diurutkan dari kiri ke kanan
+    top_5 = sorted(digits, key=lambda x: x['confidence'], reverse=True)[:5]
+    sorted_by_pos = sorted(top_5, key=lambda x: x['bbox'][0])
+    return "".join([d['class_name'] for d in sorted_by_pos])
+
+def render_detection(img, det, save_to_results=False):
+    # Gambar anotasi hasil deteksi, simpan gambar hasil, dan susun tuple hasil akhir
     img_result = img.copy()
-    kwh_results = kwh_model(img)
-    kwh_status, max_kwh_conf, best_kwh_box = "bukan_kwh", 0, None
-    if kwh_results and kwh_results[0].boxes:
-        for box in kwh_results[0].boxes:
-            if box.conf[0] > max_kwh_conf:
-                max_kwh_conf = box.conf[0]
-                kwh_status = kwh_model.names[int(box.cls[0].item())]
-                best_kwh_box = box.xyxy[0]
-    if best_kwh_box is not None:
-        kx1, ky1, kx2, ky2 = map(int, best_kwh_box)
-        label = f"{kwh_status} ({max_kwh_conf:.2f})"
+    kwh_status = det['kwh_status']
+    if det['kwh_box'] is not None:
+        kx1, ky1, kx2, ky2 = det['kwh_box']
+        label = f"{kwh_status} ({det['kwh_conf']:.2f})"
         cv2.rectangle(img_result, (kx1, ky1), (kx2, ky2), (255, 0, 0), 2)
         cv2.putText(img_result, label, (kx1, ky1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
     ocr_text_result = f"Status: {kwh_status}"
     sai = ""
-    if kwh_status != 'kwh_jelas':
-        result_filename = f"{uuid.uuid4()}.jpg"
-        result_folder = os.path.join("static", "results") if save_to_results else app.config['UPLOAD_FOLDER']
-        result_path = os.path.join(result_folder, result_filename)
-        cv2.imwrite(result_path, img_result)
-        anotasi_link = "/" + result_path.replace("\\", "/")
-        return result_path, ocr_text_result, kwh_status, sai, anotasi_link
-    stand_results = stand_model(img)
-    best_stand_box, max_stand_conf = None, 0
-    if stand_results and stand_results[0].boxes:
-        for box in stand_results[0].boxes:
-            if box.conf[0] > max_stand_conf:
-                max_stand_conf = box.conf[0]
-                best_stand_box = box.xyxy[0]
-    if best_stand_box is None:
-        ocr_text_result = f"Status: {kwh_status} -> Gagal mendeteksi stand."
-        result_filename = f"{uuid.uuid4()}.jpg"
-        result_folder = os.path.join("static", "results") if save_to_results else app.config['UPLOAD_FOLDER']
-        result_path = os.path.join(result_folder, result_filename)
-        cv2.imwrite(result_path, img_result)
-        anotasi_link = "/" + result_path.replace("\\", "/")
-        return result_path, ocr_text_result, kwh_status, sai, anotasi_link
-    sx1, sy1, sx2, sy2 = map(int, best_stand_box)
-    cv2.rectangle(img_result, (sx1, sy1), (sx2, sy2), (0, 255, 0), 2)
-    roi = img[sy1:sy2, sx1:sx2]
-    ocr_results = ocr_model(roi)
-    all_detections = []
-    if ocr_results and ocr_results[0].boxes:
-        for box in ocr_results[0].boxes:
-            all_detections.append({'bbox': list(map(int, box.xyxy[0])), 'class_name': ocr_model.names[int(box.cls[0].item())], 'confidence': box.conf[0].item()})
-    if not all_detections:
-        ocr_text_result = f"Status: {kwh_status} -> Stand terdeteksi, angka tidak terbaca."
-    else:
-        top_5 = sorted(all_detections, key=lambda x: x['confidence'], reverse=True)[:5]
-        sorted_by_pos = sorted(top_5, key=lambda x: x['bbox'][0])
-        sai = "".join([det['class_name'] for det in sorted_by_pos])
-        cv2.putText(img_result, sai, (sx1, sy1 - 15), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
-        ocr_text_result = f"Status: {kwh_status} -> Angka: {sai}"
+    if kwh_status == 'kwh_jelas':
+        if det['stand_box'] is None:
+            ocr_text_result = f"Status: {kwh_status} -> Gagal mendeteksi stand."
+        else:
+            sx1, sy1, sx2, sy2 = det['stand_box']
+            cv2.rectangle(img_result, (sx1, sy1), (sx2, sy2), (0, 255, 0), 2)
+            if not det['digits']:
+                ocr_text_result = f"Status: {kwh_status} -> Stand terdeteksi, angka tidak terbaca."
+            else:
+                sai = digits_to_sai(det['digits'])
+                cv2.putText(img_result, sai, (sx1, sy1 - 15), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
+                ocr_text_result = f"Status: {kwh_status} -> Angka: {sai}"
     result_filename = f"{uuid.uuid4()}.jpg"
     result_folder = os.path.join("static", "results") if save_to_results else app.config['UPLOAD_FOLDER']
     result_path = os.path.join(result_folder, result_filename)
@@ -174,38 +587,105 @@ def process_single_image(image_path, save_to_results=False):
     anotasi_link = "/" + result_path.replace("\\", "/")
     return result_path, ocr_text_result, kwh_status, sai, anotasi_link
 
+def process_batch_images(images, save_to_results=False, models=None, stage_timings=None, cache_keys=None):
+    """
+    Versi batch dari process_single_image. Menerima list gambar yang sudah di-decode
+    (ndarray BGR, atau None bila gagal dibaca) dan mengembalikan list tuple
+    (result_path, text, ket, sai, anotasi) dengan urutan yang sama.
+    models dan stage_timings diteruskan ke detect_batch (dipakai benchmark.py).
+    cache_keys (list, opsional, sejajar dengan images) berisi image_cache_key per gambar;
+    tahap kaskade yang keluarannya sudah ada di STAGE_CACHE tidak dijalankan lagi.
+    """
+    if models is None and not MODELS_LOADED:
+        return [(None, "Error: Model AI tidak berhasil dimuat.", None, None, None) for _ in images]
+    outputs = [(None, "Gagal membaca file gambar.", None, None, None) for _ in images]
+    valid_idx = [i for i, img in enumerate(images) if img is not None]
+    image_keys = [cache_keys[i] for i in valid_idx] if cache_keys is not None else None
+    detections = detect_batch([images[i] for i in valid_idx], models, stage_timings, image_keys)
+    started = time.perf_counter()
+    for i, det in zip(valid_idx, detections):
+        outputs[i] = render_detection(images[i], det, save_to_results)
+    if stage_timings is not None and valid_idx:
+        per_image = (time.perf_counter() - started) / len(valid_idx)
+        stage_timings.setdefault('render', []).extend([per_image] * len(valid_idx))
+    return outputs
+
+def decode_image(image_source):
+    """
+    Mengubah sumber gambar menjadi ndarray BGR tanpa file sementara.
+    Menerima path file (str), bytes mentah (bytes/bytearray/memoryview), atau ndarray.
+    Mengembalikan None bila gambar tidak bisa di-decode.
+    """
+    if isinstance(image_source, np.ndarray):
+        return image_source
+    if isinstance(image_source, (bytes, bytearray, memoryview)):
+        buffer = np.frombuffer(image_source, dtype=np.uint8)
+        if buffer.size == 0:
+            return None
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    return cv2.imread(image_source)
+
+def process_single_image(image_source, save_to_results=False, models=None, stage_timings=None):
+    if models is None and not MODELS_LOADED:
+        return None, "Error: Model AI tidak berhasil dimuat.", None, None, None
+    try:
+        started = time.perf_counter()
+        img = decode_image(image_source)
+        if stage_timings is not None:
+            stage_timings.setdefault('decode', []).append(time.perf_counter() - started)
+        if img is None: return None, "Gagal membaca file gambar.", None, None, None
+    except Exception as e:
+        return None, f"Error saat membaca gambar: {e}", None, None, None
+    cache_keys = [image_cache_key(image_source)] if isinstance(image_source, (bytes, bytearray, memoryview)) else None
+    return process_batch_images([img], save_to_results, models, stage_timings, cache_keys)[0]
+
+ORIGINALS_FOLDER = os.path.join("static", "originals")
+
+def original_image_path(ket, idpel, blth):
+    return os.path.join(ORIGINALS_FOLDER, ket, f"{idpel}_{blth}.jpg")
+
+def save_original_image(image_bytes, ket, idpel, blth):
+    # Tulis foto original (murni) sekali saja, langsung ke folder akhirnya berdasarkan ket
+    original_path = original_image_path(ket, idpel, blth)
+    os.makedirs(os.path.dirname(original_path), exist_ok=True)
+    with open(original_path, 'wb') as f: f.write(image_bytes)
+    return original_path
+
 # ==============================================================================
 # FUNGSI UPDATE DATABASE
 # ==============================================================================
 
+# VER sengaja tidak ada di bagian UPDATE: status verifikasi tidak pernah ditimpa saat proses ulang.
+# MODEL_VERSION mencatat versi kaskade yang menghasilkan SAI/KET/ANOTASI (lihat reprocess_originals).
+UPSERT_QUERY = """
+    INSERT INTO kwh_detection (BLTH, IDPEL, KET, SAHLWBP, SAI, ANOTASI, VER, MODEL_VERSION)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE KET = VALUES(KET), SAHLWBP = VALUES(SAHLWBP), SAI = VALUES(SAI), ANOTASI = VALUES(ANOTASI),
+        MODEL_VERSION = VALUES(MODEL_VERSION)
+"""
+
+def _upsert_row(blth, idpel, ket, sai, anotasi, existing_data=None):
+    blth = str(blth).strip()
+    idpel = str(idpel).strip()
+    ket = str(ket).strip() if ket else ''
+    sai = str(sai).strip() if sai else ''
+    anotasi = str(anotasi).strip() if anotasi else ''
+    sahlwbp = existing_data.get('SAHLWBP', '') if existing_data else ''
+    initial_ver = ''
+    return (blth, idpel, ket, sahlwbp, sai, anotasi, initial_ver, MODEL_VERSION)
+
 def update_database(blth, idpel, ket, sai, anotasi, existing_data=None):
-    # ... (Fungsi ini tidak berubah)
+    # Satu statement upsert; VER yang sudah ada tetap dipertahankan (lihat UPSERT_QUERY)
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        blth = str(blth).strip()
-        idpel = str(idpel).strip()
-        ket = str(ket).strip() if ket else ''
-        sai = str(sai).strip() if sai else ''
-        anotasi = str(anotasi).strip() if anotasi else ''
-        sahlwbp = existing_data.get('SAHLWBP', '') if existing_data else ''
-        cursor.execute("SELECT VER FROM kwh_detection WHERE BLTH = %s AND IDPEL = %s", (blth, idpel))
-        existing_record = cursor.fetchone()
-        if existing_record:
-            current_ver = existing_record[0] if existing_record[0] is not None else ''
-            cursor.execute("""
-                UPDATE kwh_detection 
-                SET KET = %s, SAI = %s, ANOTASI = %s, SAHLWBP = %s, VER = %s
-                WHERE BLTH = %s AND IDPEL = %s
-            """, (ket, sai, anotasi, sahlwbp, current_ver, blth, idpel))
-            print(f"✅ Updated {idpel} BLTH {blth}. Status verifikasi '{current_ver}' DIPERTAHANKAN.")
-        else:
-            initial_ver = ''
-            cursor.execute("""
-                INSERT INTO kwh_detection (BLTH, IDPEL, KET, SAHLWBP, SAI, ANOTASI, VER)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (blth, idpel, ket, sahlwbp, sai, anotasi, initial_ver))
+        row = _upsert_row(blth, idpel, ket, sai, anotasi, existing_data)
+        blth, idpel = row[0], row[1]
+        affected = cursor.execute(UPSERT_QUERY, row)
+        if affected == 1:
             print(f"✅ Inserted {idpel} BLTH {blth} ke database.")
+        else:
+            print(f"✅ Updated {idpel} BLTH {blth}. Status verifikasi DIPERTAHANKAN.")
         conn.commit()
     except Exception as e:
         print(f"❌ Error DB untuk {idpel} BLTH {blth}: {e}")
@@ -215,6 +695,1591 @@ def update_database(blth, idpel, ket, sai, anotasi, existing_data=None):
         cursor.close()
         conn.close()
 
+class DatabaseBatchWriter:
+    """
+    Menampung hasil deteksi lalu menuliskannya sebagai satu multi-row
+    INSERT ... ON DUPLICATE KEY UPDATE dalam satu transaksi, setiap batch_size baris
+    atau setiap flush_interval detik sejak baris pertama masuk buffer.
+    Tidak thread-safe; setiap thread penulis memakai instance sendiri.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or DB_WRITE_CONFIG['batch_size']
+        self.flush_interval = flush_interval or DB_WRITE_CONFIG['flush_interval']
+        self._rows = []
+        self._first_added = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, blth, idpel, ket, sai, anotasi, existing_data=None):
+        if not self._rows:
+            self._first_added = time.monotonic()
+        self._rows.append(_upsert_row(blth, idpel, ket, sai, anotasi, existing_data))
+
+    def seconds_until_due(self):
+        # Berapa lama lagi buffer harus di-flush (None bila buffer kosong)
+        if not self._rows:
+            return None
+        return max(0.0, self._first_added + self.flush_interval - time.monotonic())
+
+    def is_due(self):
+        return len(self._rows) >= self.batch_size or self.seconds_until_due() == 0.0
+
+    def flush(self):
+        # Tulis seluruh buffer; bila gagal transaksi di-rollback, buffer dikosongkan, dan error diteruskan
+        if not self._rows:
+            return 0
+        rows, self._rows = self._rows, []
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(UPSERT_QUERY, rows)
+            conn.commit()
+            print(f"✅ {len(rows)} baris disimpan ke database dalam satu batch.")
+            return len(rows)
+        except Exception as e:
+            print(f"❌ Error DB saat menyimpan batch {len(rows)} baris: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+def fetch_verified_samples(limit, verdicts=('sesuai',)):
+    """
+    Mengambil baris yang sudah diverifikasi (VER) dan foto original-nya masih ada di
+    static/originals/<KET>, untuk evaluasi model. VER 'sesuai' berarti SAI benar,
+    'tidak' berarti SAI yang tersimpan salah.
+
+    Returns:
+        list[dict]: {'path', 'blth', 'idpel', 'sai', 'ver'} per baris.
+    """
+    placeholders = ', '.join(['%s'] * len(verdicts))
+    conn = get_db_connection()
+    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute(
+            f"SELECT BLTH, IDPEL, KET, SAI, VER FROM kwh_detection WHERE VER IN ({placeholders}) "
+            "AND SAI IS NOT NULL AND SAI <> '' ORDER BY BLTH DESC, IDPEL LIMIT %s",
+            (*verdicts, limit)
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+    samples = []
+    for row in rows:
+        path = os.path.join('static', 'originals', row['KET'] or '', f"{row['IDPEL']}_{row['BLTH']}.jpg")
+        if os.path.exists(path):
+            samples.append({'path': path, 'blth': row['BLTH'], 'idpel': row['IDPEL'], 'sai': str(row['SAI']).strip(), 'ver': row['VER']})
+    return samples
+
+def fetch_existing_keys(blth_list, idpels):
+    """
+    Mengambil semua pasangan (BLTH, IDPEL) yang sudah ada di database untuk BLTH dan IDPEL
+    yang diminta, dengan beberapa query IN (...) per potongan DB_LOOKUP_CHUNK_SIZE IDPEL
+    dalam satu koneksi, bukan satu koneksi per baris Excel.
+
+    Returns:
+        set[tuple]: Himpunan (BLTH, IDPEL) yang sudah tersimpan.
+    """
+    existing = set()
+    blth_list = list(dict.fromkeys(str(blth).strip() for blth in blth_list))
+    idpels = list(dict.fromkeys(str(idpel).strip() for idpel in idpels))
+    if not blth_list or not idpels:
+        return existing
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        blth_placeholders = ", ".join(["%s"] * len(blth_list))
+        for start in range(0, len(idpels), DB_LOOKUP_CHUNK_SIZE):
+            chunk = idpels[start:start + DB_LOOKUP_CHUNK_SIZE]
+            idpel_placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"SELECT BLTH, IDPEL FROM kwh_detection WHERE BLTH IN ({blth_placeholders}) AND IDPEL IN ({idpel_placeholders})",
+                (*blth_list, *chunk))
+            existing.update((row[0], row[1]) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+        conn.close()
+    return existing
+
+# ==============================================================================
+# CACHE DISK BERBATAS UKURAN (LRU)
+# ==============================================================================
+
+class DiskLRUCache:
+    """
+    Direktori cache dengan batas ukuran total. Setiap entri adalah satu file bernama
+    <key><suffix>; entri yang paling lama tidak diakses dihapus lebih dulu ketika ukuran
+    total melewati max_bytes. Urutan akses disimpan di memori dan dibangun ulang dari
+    mtime file saat startup; mtime diperbarui setiap kali entri dibaca.
+    """
+
+    def __init__(self, directory, max_bytes, suffix=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # nama file -> ukuran, urut dari yang paling lama diakses
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)  # Sisa penulisan yang terputus
+            elif name.endswith(suffix) and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total += size
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        # Kembalikan path entri bila ada (dan tandai sebagai baru diakses), None bila tidak ada
+        name = key + self.suffix
+        path = self.path(key)
+        with self._lock:
+            if not os.path.exists(path):
+                size = self._index.pop(name, None)
+                if size is not None:
+                    self._total -= size
+                return None
+            if name not in self._index:
+                size = os.path.getsize(path)
+                self._index[name] = size
+                self._total += size
+            self._index.move_to_end(name)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def temp_path(self, key):
+        # Path sementara untuk menulis entri; selesaikan dengan commit() agar penggantian atomik
+        return f"{self.path(key)}.{uuid.uuid4().hex}.tmp"
+
+    def commit(self, key, temp_path):
+        name = key + self.suffix
+        os.replace(temp_path, self.path(key))
+        size = os.path.getsize(self.path(key))
+        with self._lock:
+            self._total += size - self._index.pop(name, 0)
+            self._index[name] = size
+            self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._index) > 1:
+            name, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+class StageCache:
+    """
+    Keluaran tahap kaskade dalam satu file SQLite (tabel stage_cache, kunci IMAGE_SHA + STAGE +
+    FINGERPRINT), dipakai bersama oleh semua thread dan proses worker web. Ukuran total dihitung
+    dari halaman database yang terpakai; bila melewati max_bytes, entri dengan LAST_USED paling
+    lama dihapus, sekitar EVICT_FRACTION dari jumlah entri sekaligus (halaman yang kosong dipakai
+    ulang oleh entri baru, jadi file tidak terus tumbuh).
+    """
+
+    EVICT_FRACTION = 0.1
+
+    def __init__(self, path, max_bytes, touch_seconds=600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_seconds = touch_seconds
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stage_cache ("
+            "IMAGE_SHA TEXT NOT NULL, STAGE TEXT NOT NULL, FINGERPRINT TEXT NOT NULL, "
+            "OUTPUT TEXT NOT NULL, LAST_USED REAL NOT NULL, "
+            "PRIMARY KEY (IMAGE_SHA, STAGE, FINGERPRINT)) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stage_cache_last_used ON stage_cache (LAST_USED)")
+
+    def _connection(self):
+        # Satu koneksi per thread; dibuat ulang setelah fork (worker gunicorn dengan --preload)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, image_sha, stage, fingerprint):
+        conn = self._connection()
+        key = (image_sha, stage, fingerprint)
+        row = conn.execute(
+            "SELECT OUTPUT, LAST_USED FROM stage_cache WHERE IMAGE_SHA = ? AND STAGE = ? AND FINGERPRINT = ?", key).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.touch_seconds:
+            conn.execute("UPDATE stage_cache SET LAST_USED = ? WHERE IMAGE_SHA = ? AND STAGE = ? AND FINGERPRINT = ?", (now, *key))
+        return json.loads(row[0])
+
+    def put(self, image_sha, stage, fingerprint, output):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO stage_cache (IMAGE_SHA, STAGE, FINGERPRINT, OUTPUT, LAST_USED) VALUES (?, ?, ?, ?, ?)",
+            (image_sha, stage, fingerprint, json.dumps(output), time.time()))
+        while self._used_bytes(conn) > self.max_bytes:
+            entries = conn.execute("SELECT COUNT(*) FROM stage_cache").fetchone()[0]
+            if entries <= 1:
+                break
+            conn.execute(
+                "DELETE FROM stage_cache WHERE (IMAGE_SHA, STAGE, FINGERPRINT) IN "
+                "(SELECT IMAGE_SHA, STAGE, FINGERPRINT FROM stage_cache ORDER BY LAST_USED LIMIT ?)",
+                (max(1, int(entries * self.EVICT_FRACTION)),))
+
+    @staticmethod
+    def _used_bytes(conn):
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+STAGE_CACHE = StageCache(STAGE_CACHE_CONFIG['path'], STAGE_CACHE_CONFIG['max_bytes'], STAGE_CACHE_CONFIG['touch_seconds']) if STAGE_CACHE_CONFIG['enabled'] else None
+
+def image_cache_key(image_bytes):
+    # SHA-256 isi foto; None bila cache nonaktif atau model gagal dimuat (hasil tidak di-cache)
+    if STAGE_CACHE is None or STAGE_FINGERPRINTS is None:
+        return None
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def get_cached_stage(stage, image_key):
+    # Keluaran satu tahap kaskade dari STAGE_CACHE, None bila tidak ada atau rusak
+    if image_key is None:
+        return None
+    try:
+        return STAGE_CACHE.get(image_key, stage, STAGE_FINGERPRINTS[stage])
+    except (sqlite3.Error, ValueError) as e:
+        print(f"⚠️ Gagal membaca cache tahap {stage}: {e}")
+        return None
+
+def store_cached_stage(stage, image_key, output):
+    if image_key is None:
+        return
+    try:
+        STAGE_CACHE.put(image_key, stage, STAGE_FINGERPRINTS[stage], output)
+    except sqlite3.Error as e:
+        print(f"⚠️ Gagal menyimpan cache tahap {stage}: {e}")
+
+# ==============================================================================
+# INGESTI FILE PELANGGAN (EXCEL / CSV / PARQUET)
+# ==============================================================================
+
+# Satu baris pelanggan yang dibutuhkan proses download: hanya IDPEL dan SAHLWBP
+CustomerRecord = namedtuple('CustomerRecord', ['idpel', 'sahlwbp'])
+
+def _cell_to_str(value):
+    # Nilai sel -> string; angka bulat yang terbaca sebagai float (mis. 512100022680.0) tidak diberi '.0'
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value).strip()
+
+def normalize_sahlwbp(value):
+    # Sama dengan pembersihan lama: ambil bagian sebelum titik desimal dan buang pemisah ribuan
+    return _cell_to_str(value).split('.')[0].replace(',', '').strip()
+
+def _records_from_rows(header, rows):
+    header = [_cell_to_str(col) for col in header]
+    if 'IDPEL' not in header:
+        raise ValueError("Kolom IDPEL tidak ditemukan pada file.")
+    idpel_idx = header.index('IDPEL')
+    sahlwbp_idx = header.index('SAHLWBP') if 'SAHLWBP' in header else None
+    for row in rows:
+        idpel = _cell_to_str(row[idpel_idx]) if idpel_idx < len(row) else ''
+        if not idpel:
+            continue
+        sahlwbp = normalize_sahlwbp(row[sahlwbp_idx]) if sahlwbp_idx is not None and sahlwbp_idx < len(row) else ''
+        yield CustomerRecord(idpel, sahlwbp)
+
+def _iter_xlsx(path):
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield from _records_from_rows(header, rows)
+    finally:
+        workbook.close()
+
+def _iter_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(f, dialect)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield from _records_from_rows(header, rows)
+
+def _iter_parquet(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Membaca file Parquet membutuhkan paket 'pyarrow'.")
+    parquet_file = pq.ParquetFile(path)
+    columns = [col for col in ('IDPEL', 'SAHLWBP') if col in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=10000, columns=columns):
+        data = batch.to_pydict()
+        yield from _records_from_rows(columns, zip(*[data[col] for col in columns]))
+
+def _iter_legacy_xls(path):
+    # Format .xls lama tidak didukung openpyxl, tetap dibaca lewat pandas seperti sebelumnya
+    df = pd.read_excel(path, dtype={'IDPEL': str})
+    columns = [col for col in ('IDPEL', 'SAHLWBP') if col in df.columns]
+    yield from _records_from_rows(columns, df[columns].itertuples(index=False, name=None))
+
+def iter_customer_records(path, filename):
+    """
+    Membaca file pelanggan baris per baris sebagai generator CustomerRecord tanpa memuat
+    seluruh isi file ke memori. Format ditentukan dari ekstensi nama file asli:
+    .xlsx/.xlsm (openpyxl read-only), .csv, .parquet, atau .xls (lewat pandas).
+    """
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext == '.csv':
+        return _iter_csv(path)
+    if ext == '.parquet':
+        return _iter_parquet(path)
+    if ext == '.xls':
+        return _iter_legacy_xls(path)
+    return _iter_xlsx(path)
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+WORKBOOK_CACHE = DiskLRUCache(WORKBOOK_CACHE_CONFIG['directory'], WORKBOOK_CACHE_CONFIG['max_bytes'], '.npz')
+
+def hash_upload(file_storage):
+    # SHA-256 isi file upload, dibaca per potongan lalu stream dikembalikan ke awal
+    digest = hashlib.sha256()
+    stream = file_storage.stream
+    for block in iter(lambda: stream.read(1024 * 1024), b''):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def build_workbook_cache(key, records):
+    """
+    Menulis CustomerRecord ke cache dalam format kolumnar: arsip .npz berisi array
+    idpel_<n> dan sahlwbp_<n> per potongan WORKBOOK_CACHE_CONFIG['chunk_rows'] baris,
+    ditulis sambil membaca sehingga memori tetap kecil.
+    """
+    temp_path = WORKBOOK_CACHE.temp_path(key)
+    try:
+        with zipfile.ZipFile(temp_path, 'w') as archive:
+            # Potongan kosong menjamin arsip tetap valid (terbaca np.load) untuk file tanpa baris data
+            chunks = itertools.chain(_chunked(records, WORKBOOK_CACHE_CONFIG['chunk_rows']), [[]])
+            for index, chunk in enumerate(chunks):
+                for column, values in (('idpel', [r.idpel for r in chunk]), ('sahlwbp', [r.sahlwbp for r in chunk])):
+                    with archive.open(f"{column}_{index:06d}.npy", 'w', force_zip64=True) as f:
+                        np.lib.format.write_array(f, np.array(values, dtype=str), allow_pickle=False)
+        WORKBOOK_CACHE.commit(key, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return WORKBOOK_CACHE.path(key)
+
+def iter_workbook_cache(path):
+    # Baca kembali cache kolumnar sebagai generator CustomerRecord, satu potongan per kali
+    with np.load(path, allow_pickle=False) as archive:
+        chunk_ids = sorted({name.split('_', 1)[1] for name in archive.files})
+        for chunk_id in chunk_ids:
+            for idpel, sahlwbp in zip(archive[f"idpel_{chunk_id}"].tolist(), archive[f"sahlwbp_{chunk_id}"].tolist()):
+                yield CustomerRecord(idpel, sahlwbp)
+
+def customer_cache_key(digest, filename):
+    ext = os.path.splitext(filename or '')[1].lower() or '.xlsx'
+    return f"{digest}_{ext.lstrip('.')}_v{WORKBOOK_CACHE_VERSION}"
+
+def prepare_customer_cache(file_storage, temp_folder):
+    """
+    Memastikan file pelanggan yang di-upload sudah ada di WORKBOOK_CACHE dan mengembalikan
+    path cache-nya. Kunci cache adalah hash isi file, sehingga upload ulang file yang sama
+    (BLTH lain, atau setelah sesi kedaluwarsa) tidak di-parse lagi.
+    """
+    ext = os.path.splitext(file_storage.filename or '')[1].lower() or '.xlsx'
+    key = customer_cache_key(hash_upload(file_storage), file_storage.filename)
+    cached_path = WORKBOOK_CACHE.get(key)
+    if cached_path:
+        print("♻️ File pelanggan yang sama sudah pernah di-parse, memakai cache.")
+        return cached_path
+    temp_path = os.path.join(temp_folder, f"{uuid.uuid4()}_temp{ext}")
+    file_storage.save(temp_path)
+    try:
+        cached_path = build_workbook_cache(key, iter_customer_records(temp_path, file_storage.filename))
+    finally:
+        if os.path.exists(temp_path): os.remove(temp_path)
+    return cached_path
+
+def prepare_saved_upload_cache(upload_path, filename):
+    # Seperti prepare_customer_cache untuk file upload yang sudah disimpan ke disk (job bulk)
+    key = customer_cache_key(file_sha256(upload_path), filename)
+    cached_path = WORKBOOK_CACHE.get(key)
+    if cached_path:
+        print("♻️ File pelanggan yang sama sudah pernah di-parse, memakai cache.")
+        return cached_path
+    return build_workbook_cache(key, iter_customer_records(upload_path, filename))
+
+def load_customer_records(file_storage, temp_folder):
+    # Generator CustomerRecord untuk file pelanggan yang di-upload (lewat cache hasil parsing)
+    return iter_workbook_cache(prepare_customer_cache(file_storage, temp_folder))
+
+def _skip_result(idpel, blth):
+    return {'filename': f"{idpel}_{blth}.jpg", 'result_text': "Sudah ada di database, dilewati.", 'result_image_url': '', 'is_error': True}
+
+def unique_records(records):
+    """
+    Melewatkan IDPEL yang muncul lebih dari sekali di file pelanggan (yang pertama dipakai).
+    fetch_existing_keys hanya melihat baris yang sudah ada sebelum run dimulai, sehingga tanpa
+    ini IDPEL ganda di-download, diinferensi, dan di-upsert dua kali.
+    """
+    seen = set()
+    duplicates = 0
+    for record in records:
+        if record.idpel in seen:
+            duplicates += 1
+            continue
+        seen.add(record.idpel)
+        yield record
+    if duplicates:
+        print(f"⚠️ {duplicates} IDPEL ganda di file pelanggan, hanya baris pertama yang diproses.")
+
+def generate_download_tasks(records, blth_list):
+    """
+    Mengubah aliran CustomerRecord menjadi task pipeline untuk semua BLTH. File hanya dibaca
+    sekali: setiap potongan DB_LOOKUP_CHUNK_SIZE baris dicek sekaligus ke database untuk
+    semua BLTH, lalu task per BLTH untuk potongan itu dikeluarkan. IDPEL dan BLTH ganda hanya
+    diproses sekali.
+    """
+    blth_list = list(dict.fromkeys(blth_list))
+    skipped = {blth: 0 for blth in blth_list}
+    for chunk in _chunked(unique_records(records), DB_LOOKUP_CHUNK_SIZE):
+        # Cek sekaligus pasangan (BLTH, IDPEL) yang sudah ada di database, hanya sisanya yang di-download
+        existing_keys = fetch_existing_keys(blth_list, [record.idpel for record in chunk])
+        for blth in blth_list:
+            for record in chunk:
+                task = {'blth': blth, 'idpel': record.idpel, 'existing_data': {'SAHLWBP': record.sahlwbp}}
+                if (blth, record.idpel) in existing_keys:
+                    skipped[blth] += 1
+                    task['skip_result'] = _skip_result(record.idpel, blth)
+                yield task
+    for blth, count in skipped.items():
+        print(f"⚠️ {count} IDPEL untuk BLTH {blth} sudah ada di database, dilewati.")
+
+# ==============================================================================
+# PENGAMBILAN FOTO DARI PORTAL ACMT
+# ==============================================================================
+
+class SessionExpiredError(requests.RequestException):
+    """Portal ACMT mengembalikan HTML, artinya sesi login (JSESSIONID) kedaluwarsa."""
+
+class FetchCancelledError(requests.RequestException):
+    """Download dibatalkan karena fetcher sudah dihentikan (mis. sesi kedaluwarsa)."""
+
+PATH_FOTO_BASE = 'https://portalapp.iconpln.co.id/acmt/DisplayBlobServlet1?idpel='
+PATH_FOTO_BLTH = '&blth='
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Pembatas jumlah request paralel dengan umpan balik AIMD (additive increase,
+    multiplicative decrease). Setiap respons sukses dengan latensi normal menaikkan batas
+    sekitar +1 per putaran; timeout, status 5xx/429, atau latensi jangka pendek yang jauh
+    di atas latensi jangka panjang (baseline) menurunkan batas secara perkalian.
+    Batas tidak pernah melewati plafon max_parallel.
+    """
+
+    def __init__(self, initial, minimum, maximum, latency_tolerance=2.0, decrease_factor=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._in_flight = 0
+        self._short_latency = None
+        self._baseline = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, latency=None, overloaded=False):
+        """
+        Args:
+            started (float): Nilai yang dikembalikan acquire().
+            latency (float): Durasi request dalam detik, None bila tidak ada respons.
+            overloaded (bool): True untuk timeout, error koneksi, atau status 5xx/429.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if started < self._last_decrease:
+                # Request ini dimulai sebelum batas terakhir diturunkan, umpan baliknya sudah basi
+                self._cond.notify_all()
+                return
+            if latency is not None and not overloaded:
+                # Rata-rata bergerak cepat (kondisi sekarang) dibandingkan rata-rata lambat (baseline)
+                if self._baseline is None:
+                    self._short_latency = self._baseline = latency
+                self._short_latency += (latency - self._short_latency) * 0.3
+                self._baseline += (latency - self._baseline) * 0.02
+                overloaded = self._short_latency > self._baseline * self.latency_tolerance
+            if overloaded:
+                old_limit = int(self._limit)
+                self._limit = max(self.minimum, self._limit * self.decrease_factor)
+                self._last_decrease = now
+                if self._baseline is not None:
+                    self._short_latency = self._baseline  # Butuh bukti baru sebelum turun lagi
+                if int(self._limit) < old_limit:
+                    print(f"⚠️ Portal ACMT melambat/menolak, download paralel diturunkan ke {int(self._limit)}")
+            elif latency is not None:
+                self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+            self._cond.notify_all()
+
+def is_retryable_download_error(error):
+    # Timeout, koneksi putus, 429, dan 5xx bersifat sementara; 404 dan 4xx lain sudah final
+    if isinstance(error, (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and (response.status_code == 429 or response.status_code >= 500)
+
+class CircuitBreaker:
+    """
+    Menghentikan sementara seluruh tahap download bila rasio error portal (timeout, 5xx, 429)
+    pada jendela request terakhir melewati ambang batas. Setelah masa jeda, satu request
+    percobaan dilewatkan: bila berhasil download dilanjutkan, bila gagal jeda diperpanjang.
+    """
+
+    def __init__(self, window, min_requests, error_rate, cooldown, max_cooldown):
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._outcomes = deque(maxlen=window)
+        self._state = 'closed'
+        self._cooldown = cooldown
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._cond = threading.Condition()
+
+    def _open(self):
+        self._state = 'open'
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        print(f"⛔ Error portal ACMT terlalu tinggi, download dijeda {self._cooldown:.0f} detik.")
+        self._cond.notify_all()
+
+    def wait_until_closed(self, cancelled_event):
+        # Blok pemanggil selama breaker terbuka; pada status half-open hanya satu request percobaan yang lolos.
+        # Mengembalikan True bila pemanggil adalah request percobaan itu (wajib diakhiri record/release_probe).
+        with self._cond:
+            while True:
+                if cancelled_event.is_set():
+                    raise FetchCancelledError("Download dibatalkan.")
+                if self._state == 'closed':
+                    return False
+                if self._state == 'open':
+                    remaining = self._opened_at + self._cooldown - time.monotonic()
+                    if remaining <= 0:
+                        self._state = 'half_open'
+                        continue
+                    self._cond.wait(min(remaining, 1.0))
+                    continue
+                if not self._probe_in_flight:
+                    self._probe_in_flight = True
+                    return True
+                self._cond.wait(1.0)
+
+    def release_probe(self):
+        # Request percobaan berakhir tanpa hasil yang dicatat (mis. dibatalkan atau error tak terduga):
+        # lepaskan agar request lain bisa menjadi percobaan berikutnya
+        with self._cond:
+            if self._state == 'half_open' and self._probe_in_flight:
+                self._probe_in_flight = False
+                self._cond.notify_all()
+
+    def record(self, success):
+        with self._cond:
+            if self._state == 'half_open':
+                if success:
+                    self._state = 'closed'
+                    self._outcomes.clear()
+                    self._cooldown = self.base_cooldown
+                    print("✅ Portal ACMT pulih, download dilanjutkan.")
+                    self._cond.notify_all()
+                else:
+                    self._cooldown = min(self.max_cooldown, self._cooldown * 2)
+                    self._open()
+                return
+            if self._state == 'open':
+                return  # Hasil request yang sudah berjalan sebelum breaker terbuka
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_requests and failures / len(self._outcomes) >= self.error_rate:
+                self._open()
+
+class PhotoFetcher:
+    """
+    Pengambil foto DisplayBlobServlet1 yang aman dipakai banyak thread sekaligus.
+    Semua request berbagi satu requests.Session (cookie JSESSIONID/Pool_ACMTJava yang sama)
+    dengan connection pool berukuran tetap, sehingga koneksi keep-alive dipakai ulang.
+    Jumlah request yang berjalan bersamaan diatur AdaptiveConcurrencyLimiter berdasarkan
+    latensi, timeout, dan status 5xx/429 dari portal, dengan plafon FETCH_CONFIG['max_parallel'].
+    Error sementara diulang dengan exponential backoff + jitter, dan CircuitBreaker
+    menjeda semua download saat portal sedang bermasalah.
+    Respons HTML pertama (sesi kedaluwarsa) membatalkan semua download yang sedang
+    berjalan maupun yang masih antre.
+    """
+
+    def __init__(self, jsessionid, pool_acmt, config=None):
+        self.config = {**FETCH_CONFIG, **(config or {})}
+        self.max_parallel = self.config['max_parallel']
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_parallel, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'User-Agent': 'Mozilla/5.0'})
+        self.session.cookies.update({'JSESSIONID': jsessionid, 'Pool_ACMTJava': pool_acmt})
+        self.limiter = AdaptiveConcurrencyLimiter(
+            self.config['initial_parallel'], self.config['min_parallel'], self.max_parallel,
+            self.config['latency_tolerance'], self.config['decrease_factor'])
+        self.breaker = CircuitBreaker(
+            self.config['breaker_window'], self.config['breaker_min_requests'], self.config['breaker_error_rate'],
+            self.config['breaker_cooldown'], self.config['breaker_max_cooldown'])
+        self._cancelled = threading.Event()
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        # Hentikan semua download: yang antre langsung gagal, yang berjalan diputus koneksinya
+        self._cancelled.set()
+        with self._in_flight_lock:
+            in_flight = list(self._in_flight)
+        for response in in_flight:
+            response.close()
+
+    def fetch(self, idpel, blth):
+        # Ambil satu foto dari portal ACMT, kembalikan bytes mentahnya (dengan retry untuk error sementara)
+        url = f"{PATH_FOTO_BASE}{idpel}{PATH_FOTO_BLTH}{blth}"
+        max_retries = self.config['max_retries']
+        for attempt in range(max_retries + 1):
+            is_probe = self.breaker.wait_until_closed(self._cancelled)
+            try:
+                image_bytes = self._fetch_once(url)
+            except FetchCancelledError:
+                raise
+            except SessionExpiredError:
+                self.breaker.record(True)  # Portal tetap merespons; jangan biarkan probe half-open menggantung
+                raise
+            except requests.RequestException as e:
+                retryable = is_retryable_download_error(e)
+                self.breaker.record(not retryable)
+                is_probe = False  # Sudah dicatat; selama backoff breaker bisa punya probe baru milik thread lain
+                if not retryable or attempt == max_retries:
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                print(f"🔁 Gagal download {idpel} BLTH {blth} ({e}), percobaan ulang {attempt + 1}/{max_retries} dalam {delay:.1f} detik")
+                if self._cancelled.wait(delay):
+                    raise FetchCancelledError("Download dibatalkan.")
+            else:
+                self.breaker.record(True)
+                return image_bytes
+            finally:
+                # Error selain RequestException (OSError/ValueError dari _fetch_once) tidak dicatat ke
+                # breaker; tanpa ini probe half-open menggantung dan semua worker download menunggu selamanya
+                if is_probe:
+                    self.breaker.release_probe()
+
+    def _backoff_delay(self, attempt, error):
+        # Exponential backoff dengan jitter; header Retry-After dari portal dihormati bila ada
+        delay = min(self.config['backoff_max'], self.config['backoff_base'] * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+        if retry_after.isdigit():
+            delay = max(delay, min(self.config['backoff_max'], float(retry_after)))
+        return delay
+
+    def _fetch_once(self, url):
+        acquired_at = self.limiter.acquire()
+        latency, overloaded = None, False
+        try:
+            if self.cancelled:
+                raise FetchCancelledError("Download dibatalkan.")
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, stream=True, timeout=self.config['timeout'])
+            except (requests.Timeout, requests.ConnectionError):
+                overloaded = not self.cancelled
+                raise
+            with self._in_flight_lock:
+                self._in_flight.add(response)
+            try:
+                overloaded = response.status_code == 429 or response.status_code >= 500
+                response.raise_for_status()
+                content_type = response.headers.get('Content-Type', '')
+                if 'text/html' in content_type:
+                    self.cancel()
+                    raise SessionExpiredError("Sesi login (JSESSIONID) kemungkinan kedaluwarsa.")
+                chunks = []
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if self.cancelled:
+                        raise FetchCancelledError("Download dibatalkan.")
+                    chunks.append(chunk)
+                latency = time.monotonic() - started
+                return b"".join(chunks)
+            except (requests.RequestException, OSError, AttributeError, ValueError) as e:
+                # Koneksi yang diputus oleh cancel() muncul sebagai error baca biasa
+                if self.cancelled and not isinstance(e, (SessionExpiredError, FetchCancelledError)):
+                    raise FetchCancelledError("Download dibatalkan.") from e
+                if is_retryable_download_error(e):
+                    overloaded = True
+                elif isinstance(e, requests.HTTPError) and not overloaded:
+                    latency = time.monotonic() - started  # Mis. 404: portal sehat, tetap dihitung latensinya
+                raise
+            finally:
+                with self._in_flight_lock:
+                    self._in_flight.discard(response)
+                response.close()
+        finally:
+            self.limiter.release(acquired_at, latency, overloaded)
+
+    def fetch_task(self, task):
+        # Antarmuka sumber foto untuk run_download_pipeline
+        return self.fetch(task['idpel'], task['blth'])
+
+    def close(self):
+        self.session.close()
+
+# ==============================================================================
+# PIPELINE BERTAHAP: DOWNLOAD -> INFERENSI -> DATABASE
+# ==============================================================================
+
+_PIPELINE_DONE = object()  # Penanda akhir antrean untuk setiap worker
+
+def run_download_pipeline(tasks, fetcher, config=None, on_result=None, collect_results=True):
+    """
+    Menjalankan download, inferensi, dan penulisan database sebagai tahap terpisah
+    yang saling terhubung lewat antrean berukuran terbatas, sehingga jaringan, CPU,
+    dan database bekerja bersamaan.
+
+    Args:
+        tasks (iterable): Dict berisi 'blth', 'idpel', dan 'existing_data'. Boleh berupa
+            generator; task dengan 'skip_result' langsung dicatat tanpa diproses.
+        fetcher (PhotoFetcher): Pengambil foto portal ACMT (atau OriginalPhotoReader untuk foto
+            yang sudah tersimpan); jumlah worker download mengikuti fetcher.max_parallel.
+        config (dict): Override untuk PIPELINE_CONFIG.
+        on_result (callable): Dipanggil on_result(task, result) begitu hasil satu task sudah
+            final (setelah tersimpan ke database), dari thread pipeline.
+        collect_results (bool): False agar hasil tidak ditampung di memori (cukup on_result),
+            untuk proses yang sangat panjang.
+
+    Returns:
+        list[dict]: Hasil per IDPEL/BLTH dengan urutan yang sama seperti task masuk
+        (None bila collect_results=False).
+
+    Raises:
+        SessionExpiredError: Bila sesi portal kedaluwarsa; semua download yang tersisa dibatalkan.
+    """
+    cfg = {**PIPELINE_CONFIG, **(config or {})}
+    download_queue = queue.Queue(maxsize=cfg['download_queue_size'])
+    inference_queue = queue.Queue(maxsize=cfg['inference_queue_size'])
+    db_queue = queue.Queue(maxsize=cfg['db_queue_size'])
+    results, results_lock = {}, threading.Lock()
+    session_error = []
+
+    def add_result(task, result):
+        # Dipanggil tepat sekali per task, saat hasilnya sudah final; disimpan per nomor urut task
+        if collect_results:
+            with results_lock:
+                results[task['seq']] = result
+        if on_result:
+            on_result(task, result)
+
+    def download_worker():
+        while True:
+            task = download_queue.get()
+            if task is _PIPELINE_DONE:
+                break
+            if fetcher.cancelled:
+                continue  # Sesi sudah kedaluwarsa: buang sisa antrean tanpa download
+            idpel, blth = task['idpel'], task['blth']
+            try:
+                image_bytes = fetcher.fetch_task(task)
+                print(f"✅ Gambar untuk {idpel} BLTH {blth} berhasil di-download")
+                inference_queue.put((task, image_bytes))
+            except SessionExpiredError as e:
+                print("❌ Kesalahan Fatal: Sesi login (JSESSIONID) kedaluwarsa. Proses dihentikan.")
+                session_error.append(e)
+            except FetchCancelledError:
+                continue
+            except requests.RequestException as e:
+                error_message = f"Gagal download: {e}"
+                if hasattr(e, 'response') and e.response is not None and e.response.status_code == 404:
+                    error_message = "Gagal: Gambar untuk IDPEL atau BLTH ini tidak ditemukan di server."
+                print(f"❌ {error_message} untuk IDPEL {idpel} BLTH {blth}")
+                add_result(task, {'filename': f"{idpel}_{blth}.jpg", 'result_text': error_message, 'result_image_url': '', 'is_error': True})
+            except Exception as e:
+                print(f"❌ Gagal download: {e} untuk IDPEL {idpel} BLTH {blth}")
+                add_result(task, {'filename': f"{idpel}_{blth}.jpg", 'result_text': f"Gagal download: {e}", 'result_image_url': '', 'is_error': True})
+
+    def inference_worker():
+        finished = False
+        while not finished:
+            # Ambil satu item (blocking) lalu kumpulkan item lain yang sudah siap menjadi satu batch
+            batch = [inference_queue.get()]
+            while len(batch) < INFERENCE_BATCH_SIZE and batch[-1] is not _PIPELINE_DONE:
+                try:
+                    batch.append(inference_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _PIPELINE_DONE:
+                batch.pop()
+                finished = True
+            if not batch:
+                continue
+            try:
+                outputs = process_batch_images(
+                    [decode_image(image_bytes) for _, image_bytes in batch], save_to_results=True,
+                    cache_keys=[image_cache_key(image_bytes) for _, image_bytes in batch]
+                )
+            except Exception as e:
+                outputs = [(None, f"Gagal memproses gambar: {e}", None, None, None)] * len(batch)
+            for (task, image_bytes), (result_image_path, result_text, ket, sai, anotasi) in zip(batch, outputs):
+                idpel, blth = task['idpel'], task['blth']
+                print(f"✅ Gambar untuk {idpel} BLTH {blth} berhasil diproses: {result_text}")
+                if not result_image_path:
+                    add_result(task, {'filename': f"{idpel}_{blth}.jpg", 'result_text': result_text or 'Gagal memproses gambar.', 'result_image_url': ''})
+                    continue
+                try:
+                    # Simpan foto original (murni) ke folder berdasarkan ket. Foto yang diproses ulang
+                    # dari static/originals hanya dipindah bila ket-nya berubah.
+                    previous_path = task.get('original_path')
+                    if previous_path != original_image_path(ket, idpel, blth):
+                        original_path = save_original_image(image_bytes, ket, idpel, blth)
+                        print(f"✅ Foto original untuk {idpel} BLTH {blth} disimpan di {original_path}")
+                        if previous_path:
+                            os.remove(previous_path)
+                except OSError as e:
+                    add_result(task, {'filename': f"{idpel}_{blth}.jpg", 'result_text': f"Gagal menyimpan foto original: {e}", 'result_image_url': '', 'is_error': True})
+                    continue
+                result_image_url = f"/static/results/{os.path.basename(result_image_path)}"
+                result = {'filename': f"{idpel}_{blth}.jpg", 'result_text': result_text, 'result_image_url': result_image_url}
+                db_queue.put((task, ket, sai, anotasi, result))
+
+    def db_worker():
+        writer = DatabaseBatchWriter()
+        pending = []  # (task, result) yang menunggu batch-nya tersimpan
+
+        def flush():
+            try:
+                writer.flush()
+                for task, result in pending:
+                    add_result(task, result)
+            except Exception as e:
+                for task, _ in pending:
+                    add_result(task, {'filename': f"{task['idpel']}_{task['blth']}.jpg", 'result_text': f"Gagal menyimpan ke database: {e}", 'result_image_url': '', 'is_error': True})
+            pending.clear()
+
+        while True:
+            try:
+                item = db_queue.get(timeout=writer.seconds_until_due())
+            except queue.Empty:
+                flush()  # Batas waktu flush_interval tercapai
+                continue
+            if item is _PIPELINE_DONE:
+                flush()
+                break
+            task, ket, sai, anotasi, result = item
+            writer.add(task['blth'], task['idpel'], ket, sai, anotasi, task['existing_data'])
+            pending.append((task, result))
+            if writer.is_due():
+                flush()
+
+    def start(target, count):
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    download_threads = start(download_worker, fetcher.max_parallel)
+    # Dengan INFERENCE_POOL, setiap thread inferensi menunggu proses worker; perlu minimal satu thread per worker
+    inference_count = max(cfg['inference_workers'], INFERENCE_POOL.processes if INFERENCE_POOL else 0)
+    inference_threads = start(inference_worker, inference_count)
+    db_threads = start(db_worker, cfg['db_writers'])
+    try:
+        for seq, task in enumerate(tasks):
+            if fetcher.cancelled:
+                break
+            task['seq'] = seq
+            if 'skip_result' in task:
+                add_result(task, task['skip_result'])
+                continue
+            download_queue.put(task)
+    finally:
+        # Tutup tiap tahap berurutan agar semua item yang sudah masuk antrean tetap selesai diproses
+        for stage_queue, threads in ((download_queue, download_threads), (inference_queue, inference_threads), (db_queue, db_threads)):
+            for _ in threads:
+                stage_queue.put(_PIPELINE_DONE)
+            for thread in threads:
+                thread.join()
+
+    if session_error:
+        raise session_error[0]
+    if not collect_results:
+        return None
+    return [results[seq] for seq in sorted(results)]
+
+# ==============================================================================
+# JOB ASINKRON UNTUK PROSES BULK (DOWNLOAD & PROSES DARI FILE PELANGGAN)
+# ==============================================================================
+
+class BulkJob:
+    """
+    Status satu job bulk yang berjalan di background. Hasil per IDPEL/BLTH pada run saat ini
+    dikumpulkan berurutan saat selesai, sehingga klien stream bisa membaca dari posisi mana pun
+    selama posisi itu masih ada di buffer replay (JOB_CONFIG['replay_results'] hasil terakhir).
+    Progress permanennya (daftar key, status per key, cursor) ada di tabel bulk_jobs dan
+    bulk_job_items, sehingga job bisa dilanjutkan setelah proses mati atau sesi kedaluwarsa.
+    """
+
+    FINISHED_STATUSES = ('completed', 'failed', 'session_expired', 'interrupted')
+    ACTIVE_STATUSES = ('preparing', 'queued', 'running')
+
+    def __init__(self, blth_list, total, pool_acmt=None, job_id=None, counts=None, cursor=-1, status='queued', error=None, kind='download'):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.blth_list = blth_list
+        self.total = total
+        self.pool_acmt = pool_acmt
+        self.cursor = cursor
+        self.status = status
+        self.error = error
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = self.created_at if status in self.FINISHED_STATUSES else None
+        self.results = deque(maxlen=JOB_CONFIG['replay_results'])
+        self.results_evicted = 0  # Posisi absolut results[0] pada run ini
+        self._run_processed = 0  # Key yang benar-benar di-download/diproses pada run ini (tanpa yang dilewati)
+        self.counts = {'success': 0, 'failed': 0, 'skipped': 0, **(counts or {})}
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+    def start(self):
+        with self._cond:
+            self.status = 'running'
+            self.error = None
+            self.started_at = time.time()
+            self.finished_at = None
+            self._cond.notify_all()
+
+    def add_result(self, task, result):
+        # Catat hasil satu key; mengembalikan statusnya ('success', 'failed', atau 'skipped')
+        if 'skip_result' in task:
+            outcome = 'skipped'
+        elif result.get('is_error'):
+            outcome = 'failed'
+        else:
+            outcome = 'success'
+        with self._cond:
+            if len(self.results) == self.results.maxlen:
+                self.results_evicted += 1
+            self.results.append(result)
+            self.counts[outcome] += 1
+            if outcome != 'skipped':
+                self._run_processed += 1
+            self._cond.notify_all()
+        return outcome
+
+    def add_skipped(self, reason=None):
+        # Key yang dilewati tanpa hasil per item (proses ulang: sudah diproses model versi ini, dll.)
+        with self._cond:
+            self.counts['skipped'] += 1
+            self._cond.notify_all()
+
+    def finish(self, status, error=None):
+        with self._cond:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def wait_for_results(self, position, timeout):
+        # Tunggu hasil baru setelah `position`; kembalikan (hasil_baru, sudah_selesai). hasil_baru
+        # None bila `position` sudah dibuang dari buffer replay.
+        with self._cond:
+            if self.results_evicted + len(self.results) <= position and not self.finished:
+                self._cond.wait(timeout)
+            if position < self.results_evicted:
+                return None, self.finished
+            return list(itertools.islice(self.results, position - self.results_evicted, None)), self.finished
+
+    def wait_finished(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+
+    def snapshot(self):
+        with self._cond:
+            processed = sum(self.counts.values())
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            # Key yang dilewati (sudah ada di database) selesai seketika; tidak ikut dihitung agar ETA tidak terlalu optimis
+            throughput = self._run_processed / elapsed if elapsed > 0 else 0.0
+            remaining = max(self.total - processed, 0)
+            eta = remaining / throughput if throughput > 0 and not self.finished else None
+            return {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'error': self.error,
+                'blth': self.blth_list,
+                'total': self.total,
+                'processed': processed,
+                'cursor': self.cursor,
+                'replay_from': self.results_evicted,
+                # Proses ulang tidak punya checkpoint (progresnya lewat MODEL_VERSION): jalankan lagi, bukan resume
+                'resumable': self.kind == 'download' and self.finished and self.total > 0 and (self.status != 'completed' or self.counts['failed'] > 0),
+                'counts': {**self.counts, 'is_error': self.counts['failed'] + self.counts['skipped']},
+                'elapsed_seconds': round(elapsed, 1),
+                'throughput_per_second': round(throughput, 2),
+                'eta_seconds': round(eta, 1) if eta is not None else None,
+            }
+
+class JobCheckpointWriter:
+    """
+    Menyimpan status akhir tiap key job ke bulk_job_items per batch (batch_size baris atau
+    flush_interval detik, seperti DatabaseBatchWriter), lalu memajukan CURSOR_SEQ di bulk_jobs
+    ke SEQ terakhir yang semua key sebelumnya sudah selesai. Thread-safe, karena dipanggil
+    dari beberapa thread pipeline. Checkpoint yang gagal ditulis hanya dicatat: key-nya tetap
+    pending dan akan dicek ulang saat job dilanjutkan.
+    """
+
+    ITEM_QUERY = """
+        INSERT INTO bulk_job_items (JOB_ID, SEQ, BLTH, IDPEL, STATUS, RESULT_TEXT)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE STATUS = VALUES(STATUS), RESULT_TEXT = VALUES(RESULT_TEXT)
+    """
+    CURSOR_QUERY = """
+        UPDATE bulk_jobs
+        SET CURSOR_SEQ = COALESCE((SELECT MIN(SEQ) FROM bulk_job_items WHERE JOB_ID = %s AND STATUS = 'pending'), TOTAL) - 1
+        WHERE JOB_ID = %s
+    """
+
+    def __init__(self, job, batch_size=None, flush_interval=None):
+        self.job = job
+        self.job_id = job.id
+        self.batch_size = batch_size or DB_WRITE_CONFIG['batch_size']
+        self.flush_interval = flush_interval or DB_WRITE_CONFIG['flush_interval']
+        self._rows = []
+        self._first_added = None
+        self._lock = threading.Lock()
+
+    def add(self, task, outcome, result):
+        with self._lock:
+            if not self._rows:
+                self._first_added = time.monotonic()
+            self._rows.append((self.job_id, task['job_seq'], task['blth'], task['idpel'], outcome, (result.get('result_text') or '')[:255]))
+            if len(self._rows) >= self.batch_size or time.monotonic() - self._first_added >= self.flush_interval:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(self.ITEM_QUERY, rows)
+            cursor.execute(self.CURSOR_QUERY, (self.job_id, self.job_id))
+            cursor.execute("SELECT CURSOR_SEQ FROM bulk_jobs WHERE JOB_ID = %s", (self.job_id,))
+            conn.commit()
+            self.job.cursor = cursor.fetchone()[0]
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ Gagal menyimpan checkpoint job {self.job_id} ({len(rows)} key): {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+def create_bulk_job(blth_list, pool_acmt):
+    """
+    Mendaftarkan job baru dengan status 'preparing'. Daftar key-nya diisi kemudian oleh
+    add_bulk_job_items di JOB_EXECUTOR, agar request /api/jobs tidak menunggu file pelanggan
+    di-parse. JSESSIONID tidak disimpan.
+    """
+    job = BulkJob(list(dict.fromkeys(blth_list)), 0, pool_acmt=pool_acmt, status='preparing')
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO bulk_jobs (JOB_ID, STATUS, BLTH_LIST, POOL_ACMT, TOTAL) VALUES (%s, %s, %s, %s, %s)",
+            (job.id, job.status, ','.join(job.blth_list), pool_acmt, job.total)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return job
+
+def add_bulk_job_items(job, cache_path):
+    """
+    Menyimpan semua key (BLTH, IDPEL) beserta SAHLWBP dari file pelanggan ke bulk_job_items
+    dengan nomor urut SEQ, sehingga job yang dilanjutkan tidak perlu membaca file pelanggan
+    lagi. Key dan TOTAL di-commit dalam satu transaksi; job yang proses persiapannya mati tidak
+    punya key sama sekali (TOTAL 0) dan tidak bisa dilanjutkan.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    seq = 0
+    try:
+        for chunk in _chunked(unique_records(iter_workbook_cache(cache_path)), DB_LOOKUP_CHUNK_SIZE):
+            rows = []
+            for blth in job.blth_list:
+                for record in chunk:
+                    rows.append((job.id, seq, blth, record.idpel, record.sahlwbp))
+                    seq += 1
+            cursor.executemany("INSERT INTO bulk_job_items (JOB_ID, SEQ, BLTH, IDPEL, SAHLWBP) VALUES (%s, %s, %s, %s, %s)", rows)
+        cursor.execute("UPDATE bulk_jobs SET TOTAL = %s WHERE JOB_ID = %s", (seq, job.id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    job.total = seq
+
+def load_bulk_job(job_id):
+    """
+    Membaca job dari database (mis. setelah aplikasi restart, atau job yang berjalan di worker
+    lain). Job yang tercatat masih preparing/queued/running tetapi lease-nya (UPDATED_AT) sudah lebih tua
+    dari JOB_CONFIG['lease_seconds'] dianggap 'interrupted'.
+
+    Returns:
+        BulkJob | None: None bila job tidak ditemukan.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute(
+            "SELECT JOB_ID, STATUS, BLTH_LIST, POOL_ACMT, TOTAL, CURSOR_SEQ, ERROR, "
+            "TIMESTAMPDIFF(SECOND, UPDATED_AT, CURRENT_TIMESTAMP) AS LEASE_AGE FROM bulk_jobs WHERE JOB_ID = %s", (job_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        cursor.execute("SELECT STATUS, COUNT(*) AS N FROM bulk_job_items WHERE JOB_ID = %s GROUP BY STATUS", (job_id,))
+        counts = {item['STATUS']: item['N'] for item in cursor.fetchall() if item['STATUS'] != 'pending'}
+    finally:
+        cursor.close()
+        conn.close()
+    status = row['STATUS']
+    if status in BulkJob.ACTIVE_STATUSES and row['LEASE_AGE'] > JOB_CONFIG['lease_seconds']:
+        status = 'interrupted'
+    return BulkJob(
+        row['BLTH_LIST'].split(','), row['TOTAL'], pool_acmt=row['POOL_ACMT'], job_id=row['JOB_ID'],
+        counts=counts, cursor=row['CURSOR_SEQ'], status=status, error=row['ERROR']
+    )
+
+def claim_bulk_job(job_id):
+    """
+    Mengambil alih job untuk dijalankan di proses ini dalam satu statement: hanya berhasil bila
+    job sudah selesai/berhenti atau lease-nya kedaluwarsa, sehingga dua worker tidak pernah
+    menjalankan job yang sama. Mengembalikan False bila job masih dipegang proses lain.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE bulk_jobs SET STATUS = 'running', ERROR = NULL, UPDATED_AT = CURRENT_TIMESTAMP "
+            "WHERE JOB_ID = %s AND (STATUS NOT IN ('preparing', 'queued', 'running') OR UPDATED_AT < CURRENT_TIMESTAMP - INTERVAL %s SECOND)",
+            (job_id, JOB_CONFIG['lease_seconds']))
+        conn.commit()
+        return cursor.rowcount == 1
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_job_state(job):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE bulk_jobs SET STATUS = %s, ERROR = %s WHERE JOB_ID = %s", (job.status, (job.error or '')[:255] or None, job.id))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"⚠️ Gagal menyimpan status job {job.id}: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+def reset_failed_job_items(job_id):
+    # Key yang gagal (mis. 404 atau timeout) dijadikan pending lagi agar ikut diproses ulang
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE bulk_job_items SET STATUS = 'pending', RESULT_TEXT = NULL WHERE JOB_ID = %s AND STATUS = 'failed'", (job_id,))
+        cursor.execute(JobCheckpointWriter.CURSOR_QUERY, (job_id, job_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def generate_job_tasks(job):
+    """
+    Task pipeline untuk key job yang masih pending, dibaca berurutan dari bulk_job_items
+    mulai setelah cursor job (keyset per SEQ, DB_LOOKUP_CHUNK_SIZE key per query). Key yang
+    sudah selesai tidak di-download ulang. Key pending yang ternyata sudah ada di kwh_detection
+    (proses mati setelah batch DB tersimpan tetapi sebelum checkpoint) dilewati.
+    """
+    last_seq = job.cursor
+    while True:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT SEQ, BLTH, IDPEL, SAHLWBP FROM bulk_job_items WHERE JOB_ID = %s AND STATUS = 'pending' AND SEQ > %s ORDER BY SEQ LIMIT %s",
+                (job.id, last_seq, DB_LOOKUP_CHUNK_SIZE)
+            )
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+        if not rows:
+            return
+        last_seq = rows[-1][0]
+        existing_keys = fetch_existing_keys([row[1] for row in rows], list(dict.fromkeys(row[2] for row in rows)))
+        for seq, blth, idpel, sahlwbp in rows:
+            task = {'job_seq': seq, 'blth': blth, 'idpel': idpel, 'existing_data': {'SAHLWBP': sahlwbp}}
+            if (blth, idpel) in existing_keys:
+                task['skip_result'] = _skip_result(idpel, blth)
+            yield task
+
+JOBS = {}  # Hanya job yang dijalankan proses ini
+JOBS_LOCK = threading.Lock()
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_CONFIG['max_concurrent_jobs'], thread_name_prefix='bulk-job')
+_LEASE_THREAD = None
+
+def _refresh_job_leases():
+    # Perbarui UPDATED_AT semua job bulk yang dipegang proses ini (termasuk yang masih antre di JOB_EXECUTOR)
+    while True:
+        time.sleep(JOB_CONFIG['heartbeat_seconds'])
+        with JOBS_LOCK:
+            job_ids = [job_id for job_id, job in JOBS.items() if job.kind == 'download' and not job.finished]
+        if not job_ids:
+            continue
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"UPDATE bulk_jobs SET UPDATED_AT = CURRENT_TIMESTAMP WHERE JOB_ID IN ({', '.join(['%s'] * len(job_ids))})",
+                job_ids)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ Gagal memperbarui lease job: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+def _ensure_lease_thread():
+    # Thread lease dibuat saat job pertama dimulai (bukan saat impor, agar tidak ikut ter-fork)
+    global _LEASE_THREAD
+    with JOBS_LOCK:
+        if _LEASE_THREAD is None:
+            _LEASE_THREAD = threading.Thread(target=_refresh_job_leases, daemon=True, name='bulk-job-lease')
+            _LEASE_THREAD.start()
+
+def _prune_jobs():
+    # Buang dari memori job yang sudah selesai lebih lama dari retention_seconds (datanya tetap di database)
+    cutoff = time.time() - JOB_CONFIG['retention_seconds']
+    with JOBS_LOCK:
+        for job_id in [job_id for job_id, job in JOBS.items() if job.finished and job.finished_at < cutoff]:
+            del JOBS[job_id]
+
+def get_job(job_id):
+    # Job milik proses ini dari memori; selain itu (restart, atau berjalan di worker lain) dibaca dari database
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    return job or load_bulk_job(job_id)
+
+def is_local_job(job):
+    with JOBS_LOCK:
+        return JOBS.get(job.id) is job
+
+def prepare_bulk_job(job, upload_path, filename):
+    # Parse file pelanggan yang di-upload lalu isi daftar key job; file upload dihapus setelahnya
+    try:
+        add_bulk_job_items(job, prepare_saved_upload_cache(upload_path, filename))
+        return True
+    except Exception as e:
+        print(f"❌ Gagal menyiapkan job {job.id}: {e}")
+        job.finish('failed', f'File pelanggan gagal diproses: {e}')
+        save_job_state(job)
+        return False
+    finally:
+        if os.path.exists(upload_path): os.remove(upload_path)
+
+def run_bulk_job(job, jsessionid, pool_acmt, upload=None):
+    if upload and not prepare_bulk_job(job, *upload):
+        return
+    job.start()
+    save_job_state(job)
+    print(f"--- Job {job.id} dimulai untuk BLTH: {', '.join(job.blth_list)} (cursor {job.cursor}) ---")
+    fetcher = PhotoFetcher(jsessionid, pool_acmt)
+    checkpoint = JobCheckpointWriter(job)
+
+    def on_result(task, result):
+        checkpoint.add(task, job.add_result(task, result), result)
+
+    status, error = 'completed', None
+    try:
+        run_download_pipeline(generate_job_tasks(job), fetcher, on_result=on_result, collect_results=False)
+        print(f"🎉 Job {job.id} selesai: {job.counts}")
+    except SessionExpiredError:
+        status, error = 'session_expired', 'Gagal: Sesi login (JSESSIONID) salah atau kedaluwarsa. Lanjutkan job dengan JSESSIONID baru.'
+    except Exception as e:
+        print(f"❌ Error utama di job {job.id}: {e}")
+        status, error = 'failed', f'Terjadi kesalahan saat memproses: {e}'
+    finally:
+        fetcher.close()
+    # Checkpoint terakhir ditulis sebelum status selesai terlihat oleh klien
+    checkpoint.flush()
+    job.finish(status, error)
+    save_job_state(job)
+
+def start_bulk_job(job, jsessionid, pool_acmt, upload=None):
+    """
+    Menjalankan job di JOB_EXECUTOR. Mengembalikan False bila job yang sama masih berjalan.
+    Untuk job baru, `upload` = (path file upload, nama file asli) yang di-parse di executor.
+    """
+    _prune_jobs()
+    with JOBS_LOCK:
+        current = JOBS.get(job.id)
+        if current and not current.finished:
+            return False
+        JOBS[job.id] = job
+    _ensure_lease_thread()
+    JOB_EXECUTOR.submit(run_bulk_job, job, jsessionid, pool_acmt, upload)
+    return True
+
+# ==============================================================================
+# PROSES ULANG FOTO ORIGINAL (SETELAH GANTI MODEL)
+# ==============================================================================
+
+_ORIGINAL_NAME = re.compile(r'^(?P<idpel>[^_]+)_(?P<blth>\d{6})\.jpg$')
+
+class OriginalPhotoReader:
+    """
+    Sumber foto untuk run_download_pipeline yang membaca foto dari static/originals, bukan
+    dari portal ACMT. Jumlah thread pembaca mengikuti REPROCESS_CONFIG['readers'].
+    """
+
+    def __init__(self, max_parallel=None):
+        self.max_parallel = max_parallel or REPROCESS_CONFIG['readers']
+        self.cancelled = False
+
+    def fetch_task(self, task):
+        with open(task['original_path'], 'rb') as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+def iter_original_photos(blth_list=None, ket_list=None):
+    """
+    Menelusuri static/originals/<ket>/<idpel>_<blth>.jpg secara streaming (os.scandir).
+
+    Yields:
+        tuple: (ket, idpel, blth, path)
+    """
+    if not os.path.isdir(ORIGINALS_FOLDER):
+        return
+    for ket in sorted(os.listdir(ORIGINALS_FOLDER)):
+        folder = os.path.join(ORIGINALS_FOLDER, ket)
+        if (ket_list and ket not in ket_list) or not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                match = _ORIGINAL_NAME.match(entry.name)
+                if match and (not blth_list or match['blth'] in blth_list):
+                    yield ket, match['idpel'], match['blth'], entry.path
+
+def fetch_detection_rows(keys):
+    """
+    Mengambil KET, SAHLWBP, ANOTASI, dan MODEL_VERSION untuk daftar (BLTH, IDPEL) dalam satu
+    query IN (...) (panggil per potongan DB_LOOKUP_CHUNK_SIZE key).
+
+    Returns:
+        dict: {(BLTH, IDPEL): row_dict}
+    """
+    blth_list = list(dict.fromkeys(blth for blth, _ in keys))
+    idpels = list(dict.fromkeys(idpel for _, idpel in keys))
+    if not keys:
+        return {}
+    conn = get_db_connection()
+    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute(
+            f"SELECT BLTH, IDPEL, KET, SAHLWBP, ANOTASI, MODEL_VERSION FROM kwh_detection "
+            f"WHERE BLTH IN ({', '.join(['%s'] * len(blth_list))}) AND IDPEL IN ({', '.join(['%s'] * len(idpels))})",
+            (*blth_list, *idpels))
+        return {(row['BLTH'], row['IDPEL']): row for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        conn.close()
+
+def generate_reprocess_tasks(photos, force=False, on_skip=None):
+    """
+    Mengubah foto original menjadi task run_download_pipeline. Foto dilewati (on_skip(alasan)
+    dipanggil, tanpa task) bila baris database-nya tidak ada, sudah diproses MODEL_VERSION saat
+    ini (kecuali force), atau merupakan salinan lama di folder ket yang bukan KET terbaru.
+    """
+    for chunk in _chunked(photos, DB_LOOKUP_CHUNK_SIZE):
+        rows = fetch_detection_rows([(blth, idpel) for _, idpel, blth, _ in chunk])
+        for ket, idpel, blth, path in chunk:
+            row = rows.get((blth, idpel))
+            if row is None:
+                reason = 'tidak_ada_di_database'
+            elif row['KET'] != ket and os.path.exists(original_image_path(row['KET'] or '', idpel, blth)):
+                reason = 'salinan_lama'
+            elif not force and row['MODEL_VERSION'] == MODEL_VERSION:
+                reason = 'versi_model_sama'
+            else:
+                yield {
+                    'blth': blth, 'idpel': idpel, 'original_path': path,
+                    'existing_data': {'SAHLWBP': row['SAHLWBP'] or ''},
+                    'previous_anotasi': row['ANOTASI'],
+                }
+                continue
+            if on_skip:
+                on_skip(reason)
+
+def _remove_previous_annotation(anotasi):
+    # Hapus gambar anotasi lama di static/results yang sudah digantikan hasil proses ulang
+    if not anotasi or not anotasi.startswith('/static/results/'):
+        return
+    try:
+        os.remove(os.path.join('static', 'results', os.path.basename(anotasi)))
+    except OSError:
+        pass
+
+def reprocess_originals(blth_list=None, ket_list=None, force=False, on_result=None, on_skip=None):
+    """
+    Memproses ulang foto di static/originals dengan model yang sedang dimuat, lewat pipeline
+    yang sama dengan download (pembaca file -> inferensi batch -> DatabaseBatchWriter), sehingga
+    SAI/KET/ANOTASI diperbarui dengan aturan upsert yang sama dan VER tetap. Inkremental: foto
+    yang MODEL_VERSION-nya sudah sama dilewati, jadi aman dijalankan terjadwal (mis. tiap malam).
+
+    Args:
+        blth_list (list, opsional): Hanya BLTH ini.
+        ket_list (list, opsional): Hanya folder ket ini.
+        force (bool): Proses ulang walaupun MODEL_VERSION sudah sama.
+        on_result (callable): on_result(task, result) per foto yang diproses ulang.
+        on_skip (callable): on_skip(alasan) per foto yang dilewati.
+    """
+    if not MODELS_LOADED:
+        raise RuntimeError("Model AI tidak berhasil dimuat.")
+
+    def handle_result(task, result):
+        if not result.get('is_error') and result.get('result_image_url'):
+            _remove_previous_annotation(task['previous_anotasi'])
+        if on_result:
+            on_result(task, result)
+
+    reader = OriginalPhotoReader()
+    tasks = generate_reprocess_tasks(iter_original_photos(blth_list, ket_list), force, on_skip)
+    run_download_pipeline(tasks, reader, config={'inference_workers': REPROCESS_CONFIG['inference_workers']},
+                          on_result=handle_result, collect_results=False)
+
+def run_reprocess_job(job, ket_list, force):
+    # Menghitung foto di static/originals bisa lama untuk folder besar; dilakukan di sini, bukan di request
+    job.total = sum(1 for _ in iter_original_photos(job.blth_list, ket_list))
+    job.start()
+    print(f"--- Proses ulang {job.id} dimulai (versi model {MODEL_VERSION}, {job.total} foto) ---")
+    status, error = 'completed', None
+    try:
+        reprocess_originals(job.blth_list, ket_list, force, on_result=job.add_result, on_skip=job.add_skipped)
+        print(f"🎉 Proses ulang {job.id} selesai: {job.counts}")
+    except Exception as e:
+        print(f"❌ Error utama di proses ulang {job.id}: {e}")
+        status, error = 'failed', f'Terjadi kesalahan saat memproses: {e}'
+    job.finish(status, error)
+
+def start_reprocess_job(blth_list=None, ket_list=None, force=False):
+    """
+    Menjalankan reprocess_originals di JOB_EXECUTOR sebagai BulkJob (kind 'reprocess', hanya di
+    memori; progresnya permanen lewat MODEL_VERSION). Mengembalikan None bila masih ada proses
+    ulang lain yang berjalan.
+    """
+    _prune_jobs()
+    job = BulkJob(blth_list or [], 0, kind='reprocess')
+    with JOBS_LOCK:
+        if any(other.kind == 'reprocess' and not other.finished for other in JOBS.values()):
+            return None
+        JOBS[job.id] = job
+    JOB_EXECUTOR.submit(run_reprocess_job, job, ket_list, force)
+    return job
+
 # ==============================================================================
 # ROUTE / ENDPOINT APLIKASI WEB
 # ==============================================================================
@@ -229,35 +2294,40 @@ def serve_uploaded_file(filename):
 
 @app.route('/api/process_upload', methods=['POST'])
 def handle_process_upload():
-    # ... (Fungsi ini tidak berubah)
+    # Semua gambar di-decode dulu lalu diproses dalam satu batch inference
     if 'images' not in request.files:
         return jsonify({'error': 'Tidak ada file gambar yang dikirim. Silakan pilih setidaknya satu file gambar.'}), 400
     files = request.files.getlist('images')
-    results = []
-    for file in files:
+    results = [None] * len(files)
+    images, cache_keys, batch_idx = [], [], []
+    for i, file in enumerate(files):
         if not file.filename:
-            results.append({'filename': 'unknown', 'result_text': 'Gagal: Nama file tidak valid.', 'result_image_url': ''})
+            results[i] = {'filename': 'unknown', 'result_text': 'Gagal: Nama file tidak valid.', 'result_image_url': ''}
             continue
-        temp_filename = f"{uuid.uuid4()}_{file.filename}"
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
         try:
-            file.save(temp_path)
-            result_image_path, result_text, ket, sai, anotasi = process_single_image(temp_path, save_to_results=False)
-            if result_image_path:
-                result_image_url = f"/uploads/{os.path.basename(result_image_path)}"
-                results.append({'filename': file.filename, 'result_text': result_text, 'result_image_url': result_image_url})
-            else:
-                results.append({'filename': file.filename, 'result_text': result_text or 'Gagal: Gambar tidak dapat diproses.', 'result_image_url': ''})
+            # Decode langsung dari stream upload, tanpa menyimpan file sementara
+            image_bytes = file.read()
+            images.append(decode_image(image_bytes))
+            cache_keys.append(image_cache_key(image_bytes))
+            batch_idx.append(i)
         except Exception as e:
-            results.append({'filename': file.filename, 'result_text': f'Gagal memproses gambar: {str(e)}', 'result_image_url': ''})
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            results[i] = {'filename': file.filename, 'result_text': f'Gagal memproses gambar: {str(e)}', 'result_image_url': ''}
+    try:
+        outputs = process_batch_images(images, save_to_results=False, cache_keys=cache_keys)
+    except Exception as e:
+        outputs = [(None, f'Gagal memproses gambar: {str(e)}', None, None, None)] * len(images)
+    for i, (result_image_path, result_text, ket, sai, anotasi) in zip(batch_idx, outputs):
+        filename = files[i].filename
+        if result_image_path:
+            result_image_url = f"/uploads/{os.path.basename(result_image_path)}"
+            results[i] = {'filename': filename, 'result_text': result_text, 'result_image_url': result_image_url}
+        else:
+            results[i] = {'filename': filename, 'result_text': result_text or 'Gagal: Gambar tidak dapat diproses.', 'result_image_url': ''}
     return jsonify(results)
 
 @app.route('/api/download_and_process', methods=['POST'])
 def handle_download_and_process():
-    # ... (Fungsi ini diubah untuk cek database sebelum download dan simpan original berdasarkan ket)
+    # Download, inferensi, dan simpan database berjalan sebagai pipeline bertahap (lihat run_download_pipeline)
     jsessionid = request.form.get('jsessionid')
     pool_acmt = request.form.get('poolacmt')
     blth_string = request.form.get('blth')
@@ -265,101 +2335,232 @@ def handle_download_and_process():
     if not all([excel_file, blth_string, jsessionid, pool_acmt]):
         return jsonify({'error': 'Semua field harus diisi lengkap'}), 400
     blth_list = [item for item in re.split(r'[\s,;]+', blth_string) if item]
-    excel_temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_temp.xlsx")
-    excel_file.save(excel_temp_path)
-    download_temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(uuid.uuid4()))
-    os.makedirs(download_temp_dir)
-    results = []
     try:
-        df = pd.read_excel(excel_temp_path, dtype={'IDPEL': str})
-        if 'SAHLWBP' in df.columns:
-            df['SAHLWBP'] = df['SAHLWBP'].fillna('').astype(str).str.split('.').str[0].str.replace(',', '').str.strip()
-        columns = df.columns.tolist()
-        session = requests.Session()
-        session.headers.update({'User-Agent': 'Mozilla/5.0'})
-        session.cookies.update({'JSESSIONID': jsessionid, 'Pool_ACMTJava': pool_acmt})
-        path_foto_base = 'https://portalapp.iconpln.co.id/acmt/DisplayBlobServlet1?idpel='
-        path_foto_blth = '&blth='
-        for blth in blth_list:
-            print(f"--- Memulai proses untuk BLTH: {blth} ---")
-            for index, row in df.iterrows():
-                idpel = str(row['IDPEL']).strip()
-                existing_data = {col: str(row.get(col, '')).strip() for col in columns if col not in ['IDPEL', 'BLTH']}
-                # Cek apakah sudah ada di database
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM kwh_detection WHERE BLTH = %s AND IDPEL = %s", (blth, idpel))
-                if cursor.fetchone():
-                    print(f"⚠️ IDPEL {idpel} BLTH {blth} sudah ada di database, dilewati.")
-                    results.append({'filename': f"{idpel}_{blth}.jpg", 'result_text': "Sudah ada di database, dilewati.", 'result_image_url': '', 'is_error': True})
-                    cursor.close()
-                    conn.close()
-                    continue
-                cursor.close()
-                conn.close()
-                url = f"{path_foto_base}{idpel}{path_foto_blth}{blth}"
-                try:
-                    response = session.get(url, stream=True, timeout=15)
-                    response.raise_for_status()
-                    content_type = response.headers.get('Content-Type', '')
-                    if 'text/html' in content_type:
-                        raise requests.RequestException("Sesi login (JSESSIONID) kemungkinan kedaluwarsa.")
-                    downloaded_img_path = os.path.join(download_temp_dir, f"{idpel}_{blth}.jpg")
-                    with open(downloaded_img_path, 'wb') as f: f.write(response.content)
-                    print(f"✅ Gambar untuk {idpel} BLTH {blth} berhasil di-download")
-                    result_image_path, result_text, ket, sai, anotasi = process_single_image(downloaded_img_path, save_to_results=True)
-                    print(f"✅ Gambar untuk {idpel} BLTH {blth} berhasil diproses: {result_text}")
-                    if result_image_path:
-                        result_image_url = f"/static/results/{os.path.basename(result_image_path)}"
-                        results.append({'filename': f"{idpel}_{blth}.jpg", 'result_text': result_text, 'result_image_url': result_image_url})
-                        # Simpan foto original (murni) ke folder berdasarkan ket
-                        original_folder = os.path.join("static", "originals", ket)
-                        os.makedirs(original_folder, exist_ok=True)
-                        original_path = os.path.join(original_folder, f"{idpel}_{blth}.jpg")
-                        shutil.copy(downloaded_img_path, original_path)
-                        print(f"✅ Foto original untuk {idpel} BLTH {blth} disimpan di {original_path}")
-                        update_database(blth, idpel, ket, sai, anotasi, existing_data)
-                    else:
-                        results.append({'filename': f"{idpel}_{blth}.jpg", 'result_text': result_text or 'Gagal memproses gambar.', 'result_image_url': ''})
-                except requests.RequestException as e:
-                    if "Sesi login" in str(e):
-                        print("❌ Kesalahan Fatal: Sesi login (JSESSIONID) kedaluwarsa. Proses dihentikan.")
-                        return jsonify({'error': 'Gagal: Sesi login (JSESSIONID) salah atau kedaluwarsa. Proses dihentikan.'}), 400
-                    error_message = f"Gagal download: {e}"
-                    if hasattr(e, 'response') and e.response is not None and e.response.status_code == 404:
-                        error_message = "Gagal: Gambar untuk IDPEL atau BLTH ini tidak ditemukan di server."
-                    print(f"❌ {error_message} untuk IDPEL {idpel} BLTH {blth}")
-                    results.append({'filename': f"{idpel}_{blth}.jpg", 'result_text': error_message, 'result_image_url': '', 'is_error': True})
+        print(f"--- Memulai proses untuk BLTH: {', '.join(blth_list)} ---")
+        # File pelanggan di-parse sekali (atau diambil dari cache), lalu dibaca streaming untuk semua BLTH
+        records = load_customer_records(excel_file, app.config['UPLOAD_FOLDER'])
+        fetcher = PhotoFetcher(jsessionid, pool_acmt)
+        try:
+            results = run_download_pipeline(generate_download_tasks(records, blth_list), fetcher)
+        finally:
+            fetcher.close()
+    except SessionExpiredError:
+        return jsonify({'error': 'Gagal: Sesi login (JSESSIONID) salah atau kedaluwarsa. Proses dihentikan.'}), 400
     except Exception as e:
         print(f"❌ Error utama di download_and_process: {e}")
         return jsonify({'error': f'Terjadi kesalahan saat memproses: {e}'}), 500
-    finally:
-        if os.path.exists(excel_temp_path): os.remove(excel_temp_path)
-        if os.path.exists(download_temp_dir): shutil.rmtree(download_temp_dir)
-        print("🧹 Membersihkan file sementara")
     return jsonify(results)
 
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    # Sama seperti /api/download_and_process, tetapi langsung mengembalikan job id (status 'preparing');
+    # parse file pelanggan dan prosesnya berjalan di background
+    jsessionid = request.form.get('jsessionid')
+    pool_acmt = request.form.get('poolacmt')
+    blth_string = request.form.get('blth')
+    excel_file = request.files.get('excel_file')
+    if not all([excel_file, blth_string, jsessionid, pool_acmt]):
+        return jsonify({'error': 'Semua field harus diisi lengkap'}), 400
+    blth_list = [item for item in re.split(r'[\s,;]+', blth_string) if item]
+    ext = os.path.splitext(excel_file.filename or '')[1].lower() or '.xlsx'
+    upload_path = os.path.join(JOB_UPLOAD_FOLDER, f"{uuid.uuid4()}_job{ext}")
+    try:
+        excel_file.save(upload_path)
+        job = create_bulk_job(blth_list, pool_acmt)
+        start_bulk_job(job, jsessionid, pool_acmt, upload=(upload_path, excel_file.filename))
+    except Exception as e:
+        print(f"❌ Gagal membuat job: {e}")
+        if os.path.exists(upload_path): os.remove(upload_path)
+        return jsonify({'error': f'Terjadi kesalahan saat memproses: {e}'}), 500
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f"/api/jobs/{job.id}",
+        'stream_url': f"/api/jobs/{job.id}/stream",
+    }), 202
+
+@app.route('/api/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    # Lanjutkan job yang berhenti (sesi kedaluwarsa, error, atau aplikasi restart) dengan JSESSIONID baru
+    jsessionid = request.form.get('jsessionid')
+    if not jsessionid:
+        return jsonify({'error': 'JSESSIONID baru harus diisi'}), 400
+    with JOBS_LOCK:
+        current = JOBS.get(job_id)
+    if current and not current.finished:
+        return jsonify({'error': 'Job masih berjalan'}), 409
+    try:
+        job = load_bulk_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job tidak ditemukan'}), 404
+        if job.finished and not job.total:
+            return jsonify({'error': 'File pelanggan job ini belum selesai diproses; buat job baru'}), 409
+        # Job yang masih dipegang worker lain (lease masih berlaku) tidak boleh dijalankan dua kali
+        if not claim_bulk_job(job_id):
+            return jsonify({'error': 'Job masih berjalan'}), 409
+        if request.form.get('retry_failed') in ('1', 'true', 'on'):
+            reset_failed_job_items(job_id)
+        job = load_bulk_job(job_id)
+        pool_acmt = request.form.get('poolacmt') or job.pool_acmt
+        if not start_bulk_job(job, jsessionid, pool_acmt):
+            return jsonify({'error': 'Job masih berjalan'}), 409
+    except Exception as e:
+        print(f"❌ Gagal melanjutkan job {job_id}: {e}")
+        return jsonify({'error': f'Terjadi kesalahan saat memproses: {e}'}), 500
+    return jsonify({
+        'job_id': job.id,
+        'status_url': f"/api/jobs/{job.id}",
+        'stream_url': f"/api/jobs/{job.id}/stream",
+        'total': job.total,
+        'processed': sum(job.counts.values()),
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job tidak ditemukan'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/api/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    # Hasil per item dikirim begitu selesai: NDJSON (default) atau Server-Sent Events (?format=sse)
+    # Posisi `from` dihitung dari awal run terakhir job (run baru dimulai setiap kali job dilanjutkan);
+    # posisi di bawah replay_from (sudah keluar dari buffer replay) hanya mendapat event status
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job tidak ditemukan'}), 404
+    try:
+        position = max(0, int(request.args.get('from', 0)))
+    except ValueError:
+        return jsonify({'error': 'Parameter from harus berupa angka'}), 400
+    use_sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+
+    def encode(event_type, payload):
+        if use_sse:
+            return f"event: {event_type}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps({'type': event_type, **payload}) + "\n"
+
+    def generate(position, job):
+        # Job yang berjalan di worker lain tidak punya hasil per item di proses ini: hanya status,
+        # yang dibaca ulang dari database setiap heartbeat sampai job selesai
+        local = is_local_job(job)
+        replay = True
+        last_status = 0.0
+        while True:
+            if replay:
+                new_results, finished = job.wait_for_results(position, JOB_CONFIG['heartbeat_seconds'])
+            else:
+                new_results, finished = [], job.wait_finished(JOB_CONFIG['heartbeat_seconds'])
+            if new_results is None:
+                # Posisi ini sudah keluar dari buffer replay: lanjut hanya dengan event status
+                replay, new_results, last_status = False, [], 0.0
+            if not local and not finished:
+                job = load_bulk_job(job.id) or job
+                finished = job.finished
+            for result in new_results:
+                yield encode('result', {'index': position, 'result': result})
+                position += 1
+            if finished and not new_results:
+                yield encode('done', {'status': job.snapshot()})
+                return
+            # Status berkala sekaligus menjadi heartbeat agar proxy tidak menutup koneksi
+            if time.monotonic() - last_status >= JOB_CONFIG['heartbeat_seconds']:
+                last_status = time.monotonic()
+                yield encode('status', {'status': job.snapshot()})
+
+    mimetype = 'text/event-stream' if use_sse else 'application/x-ndjson'
+    return Response(generate(position, job), mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/reprocess', methods=['POST'])
+def reprocess():
+    # Proses ulang foto di static/originals dengan model saat ini; progres lewat /api/jobs/<id>(/stream)
+    if not MODELS_LOADED:
+        return jsonify({'error': 'Model AI tidak berhasil dimuat.'}), 500
+    data = request.get_json(silent=True) or request.form
+    blth_list = [item for item in re.split(r'[\s,;]+', data.get('blth') or '') if item]
+    ket_list = [item for item in re.split(r'[\s,;]+', data.get('ket') or '') if item]
+    force = str(data.get('force', '')).lower() in ('1', 'true', 'on')
+    try:
+        job = start_reprocess_job(blth_list, ket_list, force)
+    except Exception as e:
+        print(f"❌ Gagal memulai proses ulang: {e}")
+        return jsonify({'error': f'Terjadi kesalahan saat memproses: {e}'}), 500
+    if job is None:
+        return jsonify({'error': 'Proses ulang lain masih berjalan'}), 409
+    return jsonify({
+        'job_id': job.id,
+        'status_url': f"/api/jobs/{job.id}",
+        'stream_url': f"/api/jobs/{job.id}/stream",
+        'model_version': MODEL_VERSION,
+    }), 202
+
 @app.route('/api/view_database', methods=['GET'])
 def view_database():
+    # Keyset pagination pada urutan (BLTH DESC, IDPEL DESC): halaman berikutnya diminta dengan after_blth & after_idpel.
+    # Kedua kolom sengaja searah agar MySQL bisa membaca PK (BLTH, IDPEL) maupun index (VER, BLTH) /
+    # (KET, BLTH) secara mundur tanpa filesort; klien boleh membalik urutan IDPEL dalam satu BLTH.
     conn = None
     try:
         filter_type = request.args.get('filter', 'all')
+        try:
+            limit = int(request.args.get('limit', VIEW_PAGE_CONFIG['default_limit']))
+        except ValueError:
+            return jsonify({'error': 'Parameter limit harus berupa angka'}), 400
+        limit = max(1, min(limit, VIEW_PAGE_CONFIG['max_limit']))
+
+        conditions, params = [], []
+        if filter_type == 'unverified':
+            conditions.append("(VER IS NULL OR VER = '')")
+        elif filter_type == 'sesuai':
+            conditions.append("VER = 'sesuai'")
+        elif filter_type == 'tidak':
+            conditions.append("VER = 'tidak'")
+        blth = request.args.get('blth', '').strip()
+        if blth:
+            conditions.append("BLTH = %s")
+            params.append(blth)
+        ket = request.args.get('ket', '').strip()
+        if ket:
+            conditions.append("KET = %s")
+            params.append(ket)
+        idpel_prefix = request.args.get('idpel', '').strip()
+        if idpel_prefix:
+            # Prefix LIKE tetap bisa memakai index; karakter wildcard dari input di-escape
+            escaped = idpel_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("IDPEL LIKE %s")
+            params.append(escaped + '%')
+
+        after_blth = request.args.get('after_blth', '').strip()
+        after_idpel = request.args.get('after_idpel', '').strip()
+        page_conditions, page_params = list(conditions), list(params)
+        if after_blth:
+            page_conditions.append("(BLTH, IDPEL) < (%s, %s)")
+            page_params.extend([after_blth, after_idpel])
+
         conn = get_db_connection()
         # DIUBAH: Menggunakan DictCursor agar frontend menerima data JSON dengan nama kolom
         cursor = conn.cursor(pymysql.cursors.DictCursor)
         query = "SELECT * FROM kwh_detection"
-        if filter_type == 'unverified':
-            query += " WHERE VER IS NULL OR VER = ''"
-        elif filter_type == 'sesuai':
-            query += " WHERE VER = 'sesuai'"
-        elif filter_type == 'tidak':
-            query += " WHERE VER = 'tidak'"
-        query += " ORDER BY BLTH DESC, IDPEL"
-        
-        cursor.execute(query)
+        if page_conditions:
+            query += " WHERE " + " AND ".join(page_conditions)
+        query += " ORDER BY BLTH DESC, IDPEL DESC LIMIT %s"
+        cursor.execute(query, (*page_params, limit + 1))
         rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = {'blth': rows[-1]['BLTH'], 'idpel': rows[-1]['IDPEL']} if has_more else None
+
+        # Total hanya dihitung di halaman pertama; COUNT(*) dengan filter yang sama dijawab dari index
+        total = None
+        if not after_blth:
+            count_query = "SELECT COUNT(*) AS total FROM kwh_detection"
+            if conditions:
+                count_query += " WHERE " + " AND ".join(conditions)
+            cursor.execute(count_query, params)
+            total = cursor.fetchone()['total']
         print(f"📋 Mengambil {len(rows)} baris dari database")
-        return jsonify(rows)
+        return jsonify({'rows': rows, 'next_cursor': next_cursor, 'total': total, 'limit': limit})
     except Exception as e:
         print(f"❌ Error saat query database: {e}")
         return jsonify({'error': f'Gagal mengambil data: {e}'}), 500
@@ -392,28 +2593,56 @@ def update_ver():
 
 @app.route('/api/update_all_ver', methods=['POST'])
 def update_all_ver():
-    # ... (Fungsi ini tidak berubah)
+    # Semua verdict dimasukkan ke tabel sementara lalu di-UPDATE sekaligus lewat JOIN (set-based)
     data = request.json
     if not data or not isinstance(data, list):
         return jsonify({'error': 'Data tidak valid, harus berupa daftar'}), 400
+    verdicts = {}
+    incomplete = 0
+    for item in data:
+        if not isinstance(item, dict) or not item.get('blth') or not item.get('idpel') or not item.get('ver'):
+            incomplete += 1
+            continue
+        verdicts[(str(item['blth']).strip(), str(item['idpel']).strip())] = str(item['ver']).strip()
+    if incomplete:
+        print(f"⚠️ {incomplete} data VER tidak lengkap, dilewati.")
+    if not verdicts:
+        return jsonify({'success': True, 'message': 'Tidak ada perubahan VER yang valid', 'updated': 0, 'matched': 0, 'missing': [], 'incomplete': incomplete})
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        for item in data:
-            blth = item.get('blth')
-            idpel = item.get('idpel')
-            ver = item.get('ver')
-            if not blth or not idpel or not ver:
-                print(f"⚠️ Data tidak lengkap untuk {idpel} BLTH {blth}")
-                continue
-            cursor.execute("UPDATE kwh_detection SET VER = %s WHERE BLTH = %s AND IDPEL = %s", (ver, blth, idpel))
-            print(f"✅ Updated VER untuk {idpel} BLTH {blth} ke {ver}")
+        # Struktur kolom (termasuk collation) disalin dari kwh_detection agar JOIN memakai primary key
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_ver_update")
+        cursor.execute("""
+            CREATE TEMPORARY TABLE tmp_ver_update (PRIMARY KEY (BLTH, IDPEL))
+            SELECT BLTH, IDPEL, VER FROM kwh_detection LIMIT 0
+        """)
+        cursor.executemany("INSERT INTO tmp_ver_update (BLTH, IDPEL, VER) VALUES (%s, %s, %s)",
+                           [(blth, idpel, ver) for (blth, idpel), ver in verdicts.items()])
+        updated = cursor.execute("""
+            UPDATE kwh_detection k
+            JOIN tmp_ver_update t ON k.BLTH = t.BLTH AND k.IDPEL = t.IDPEL
+            SET k.VER = t.VER
+        """)
+        cursor.execute("""
+            SELECT t.BLTH, t.IDPEL FROM tmp_ver_update t
+            LEFT JOIN kwh_detection k ON k.BLTH = t.BLTH AND k.IDPEL = t.IDPEL
+            WHERE k.IDPEL IS NULL
+        """)
+        missing = [{'blth': row[0], 'idpel': row[1]} for row in cursor.fetchall()]
         conn.commit()
-        return jsonify({'success': True, 'message': 'Semua perubahan VER tersimpan'})
+        matched = len(verdicts) - len(missing)
+        print(f"✅ Updated VER: {updated} baris berubah dari {matched} data cocok, {len(missing)} tidak ditemukan")
+        return jsonify({'success': True, 'message': 'Semua perubahan VER tersimpan', 'updated': updated, 'matched': matched, 'missing': missing, 'incomplete': incomplete})
     except Exception as e:
+        conn.rollback()
         print(f"❌ Error saat update semua VER: {e}")
         return jsonify({'error': f'Gagal menyimpan perubahan: {e}'}), 500
     finally:
+        try:
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_ver_update")
+        except Exception:
+            pass
         cursor.close()
         conn.close()
 
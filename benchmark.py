@@ -0,0 +1,222 @@
+"""
+Benchmark kecepatan dan akurasi model berdasarkan data yang sudah diverifikasi.
+
+Foto original (static/originals/<KET>) dari baris kwh_detection dengan VER 'sesuai' atau
+'tidak' diproses ulang lewat process_single_image. Yang dilaporkan:
+latensi persentil per tahap (decode, kwh, stand, ocr, render) dan end-to-end, gambar/detik,
+peak RSS, serta akurasi SAI. Untuk baris 'sesuai', SAI harus sama dengan yang tersimpan.
+Untuk baris 'tidak', SAI yang tersimpan diketahui salah, jadi yang dihitung adalah berapa
+yang masih menghasilkan bacaan salah yang sama.
+
+Mode --autotune mencoba kombinasi imgsz dan presisi per tahap (lihat AUTOTUNE_CONFIG), lalu
+memilih yang tercepat dengan akurasi SAI tidak di bawah batas, dan menyimpannya ke file profil
+inferensi (INFERENCE_PROFILE_FILE) yang dibaca app4 saat startup.
+
+Contoh:
+    python benchmark.py
+    python benchmark.py --backend onnx --precision int8 --imgsz 480 --limit 500 --json hasil.json
+    python benchmark.py --backend onnx --autotune
+"""
+
+import os
+import copy
+import json
+import time
+import argparse
+
+import numpy as np
+
+# Tool ini memuat modelnya sendiri; model global app4 tidak perlu ikut dimuat
+os.environ.setdefault('KWH_SKIP_MODEL_LOAD', '1')
+import app4
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ('decode', 'kwh', 'stand', 'ocr', 'render', 'total')
+MODEL_STAGES = ('kwh', 'stand', 'ocr')
+
+def peak_rss_mb():
+    # Peak resident set size proses ini (MB); None bila tidak tersedia di OS ini
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def latency_summary(values):
+    # Persentil latensi dalam milidetik
+    if not values:
+        return None
+    ms = np.asarray(values) * 1000
+    return {
+        'count': len(values),
+        'mean': round(float(ms.mean()), 2),
+        'p50': round(float(np.percentile(ms, 50)), 2),
+        'p90': round(float(np.percentile(ms, 90)), 2),
+        'p99': round(float(np.percentile(ms, 99)), 2),
+        'max': round(float(ms.max()), 2),
+    }
+
+def run_benchmark(samples, models, warmup=3):
+    """
+    Memproses ulang setiap sampel lewat process_single_image dengan model yang diberikan.
+
+    Args:
+        samples (list[dict]): Hasil app4.fetch_verified_samples.
+        models (tuple): (kwh_model, stand_model, ocr_model).
+        warmup (int): Jumlah sampel pertama yang diproses dulu tanpa diukur.
+
+    Returns:
+        dict: Laporan latensi, throughput, memori, dan akurasi.
+    """
+    for sample in samples[:warmup]:
+        result_path = app4.process_single_image(sample['path'], models=models)[0]
+        if result_path and os.path.exists(result_path):
+            os.remove(result_path)
+
+    timings = {}
+    correct = {'sesuai': 0, 'tidak': 0}
+    counts = {'sesuai': 0, 'tidak': 0}
+    started = time.perf_counter()
+    for sample in samples:
+        image_started = time.perf_counter()
+        result_path, _, _, sai, _ = app4.process_single_image(sample['path'], models=models, stage_timings=timings)
+        timings.setdefault('total', []).append(time.perf_counter() - image_started)
+        if result_path and os.path.exists(result_path):
+            os.remove(result_path)
+        counts[sample['ver']] += 1
+        correct[sample['ver']] += (sai or '') == sample['sai']
+    elapsed = time.perf_counter() - started
+
+    return {
+        'images': len(samples),
+        'elapsed_seconds': round(elapsed, 2),
+        'images_per_second': round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'latency_ms': {stage: latency_summary(timings.get(stage, [])) for stage in STAGES},
+        # Total waktu ketiga model dibagi jumlah gambar (tahap yang dilewati dihitung 0)
+        'inference_ms_per_image': round(sum(sum(timings.get(stage, [])) for stage in MODEL_STAGES) * 1000 / len(samples), 2) if samples else None,
+        'accuracy': {
+            'sesuai_rows': counts['sesuai'],
+            'sai_accuracy': round(correct['sesuai'] / counts['sesuai'], 4) if counts['sesuai'] else None,
+            'tidak_rows': counts['tidak'],
+            'same_wrong_sai_rate': round(correct['tidak'] / counts['tidak'], 4) if counts['tidak'] else None,
+        },
+    }
+
+def autotune(samples, backend, warmup, min_accuracy=None):
+    """
+    Mencari profil per tahap (imgsz dan presisi) yang paling cepat dengan akurasi SAI pada
+    baris 'sesuai' tidak di bawah batas. Batas default adalah akurasi profil awal dikurangi
+    AUTOTUNE_CONFIG['max_accuracy_drop']. Tahap dicoba satu per satu (ocr, stand, kwh);
+    tahap lain memakai profil terbaik sejauh ini. conf, iou, dan max_det dibiarkan apa adanya.
+
+    Returns:
+        tuple: (profil_terbaik, laporan_awal, laporan_terbaik)
+    """
+    loaded = {}
+    manifest = app4.load_quantization_manifest().get(backend, {})
+
+    def evaluate(profiles):
+        models = []
+        for stage in MODEL_STAGES:
+            precision = profiles[stage]['precision'] or app4.INFERENCE_PRECISION
+            if (stage, precision) not in loaded:
+                loaded[(stage, precision)] = app4.load_model(app4.MODEL_PATHS[stage], backend, precision)
+            models.append(loaded[(stage, precision)])
+        for stage in MODEL_STAGES:
+            app4.MODEL_PROFILES[stage].update(profiles[stage])
+        return run_benchmark(samples, tuple(models), warmup)
+
+    best = copy.deepcopy(app4.MODEL_PROFILES)
+    baseline = evaluate(best)
+    floor = min_accuracy if min_accuracy is not None else (baseline['accuracy']['sai_accuracy'] or 0.0) - app4.AUTOTUNE_CONFIG['max_accuracy_drop']
+    print(f"📊 Profil awal: {baseline['inference_ms_per_image']} ms/gambar, akurasi {baseline['accuracy']['sai_accuracy']} (batas {floor:.4f})")
+    best_report = baseline
+
+    for stage in ('ocr', 'stand', 'kwh'):
+        precisions = ['fp32']
+        if backend != 'pytorch' and manifest.get(app4.MODEL_PATHS[stage], {}).get('accepted'):
+            precisions.append('int8')
+        for precision in precisions:
+            for imgsz in app4.AUTOTUNE_CONFIG['imgsz_candidates']:
+                trial = copy.deepcopy(best)
+                trial[stage].update(imgsz=imgsz, precision=precision)
+                report = evaluate(trial)
+                accuracy = report['accuracy']['sai_accuracy'] or 0.0
+                passed = accuracy >= floor
+                print(f"   {stage:<6} imgsz={imgsz:<4} {precision:<5} -> {report['inference_ms_per_image']:>8} ms/gambar, akurasi {accuracy:.4f}{'' if passed else ' (di bawah batas)'}")
+                if passed and report['inference_ms_per_image'] < best_report['inference_ms_per_image']:
+                    best, best_report = trial, report
+        print(f"✅ Profil {stage}: {best[stage]}")
+
+    for stage in MODEL_STAGES:
+        app4.MODEL_PROFILES[stage].update(best[stage])
+    return best, baseline, best_report
+
+def print_report(report, config):
+    print("\n📊 Hasil Benchmark")
+    print("---------------------------------")
+    print(f"Konfigurasi     : {config}")
+    print(f"Jumlah gambar   : {report['images']} ({report['elapsed_seconds']} detik)")
+    print(f"Throughput      : {report['images_per_second']} gambar/detik")
+    print(f"Inferensi model : {report['inference_ms_per_image']} ms/gambar")
+    print(f"Peak RSS        : {report['peak_rss_mb']} MB")
+    print(f"{'Tahap':<8}{'n':>7}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")
+    for stage, summary in report['latency_ms'].items():
+        if summary:
+            print(f"{stage:<8}{summary['count']:>7}{summary['mean']:>10}{summary['p50']:>10}{summary['p90']:>10}{summary['p99']:>10}{summary['max']:>10}")
+    accuracy = report['accuracy']
+    print(f"Akurasi SAI     : {accuracy['sai_accuracy']} dari {accuracy['sesuai_rows']} baris VER='sesuai'")
+    print(f"SAI salah sama  : {accuracy['same_wrong_sai_rate']} dari {accuracy['tidak_rows']} baris VER='tidak'")
+    print("---------------------------------")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark latensi dan akurasi SAI terhadap data terverifikasi.")
+    parser.add_argument('--backend', choices=('pytorch', 'onnx', 'openvino'), default=app4.INFERENCE_BACKEND)
+    parser.add_argument('--precision', choices=('fp32', 'int8'), default=None, help='Presisi semua tahap (default: dari profil)')
+    parser.add_argument('--profiles', default=None, help='File profil inferensi JSON (default: INFERENCE_PROFILE_FILE)')
+    parser.add_argument('--imgsz', type=int, default=None, help='imgsz untuk semua tahap (default: dari profil)')
+    parser.add_argument('--limit', type=int, default=None, help='Jumlah baris terverifikasi maksimum')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--json', dest='json_path', default=None, help='Simpan laporan ke file JSON')
+    parser.add_argument('--autotune', action='store_true', help='Cari profil tercepat yang memenuhi batas akurasi')
+    parser.add_argument('--min-accuracy', type=float, default=None, help='Batas akurasi SAI absolut untuk --autotune')
+    parser.add_argument('--output', default=app4.INFERENCE_PROFILE_FILE, help='File tujuan profil hasil --autotune')
+    args = parser.parse_args()
+
+    if args.profiles:
+        app4.load_inference_profiles(args.profiles)
+    for stage in MODEL_STAGES:
+        if args.imgsz:
+            app4.MODEL_PROFILES[stage]['imgsz'] = args.imgsz
+        if args.precision:
+            app4.MODEL_PROFILES[stage]['precision'] = args.precision
+
+    if args.autotune:
+        samples = app4.fetch_verified_samples(args.limit or app4.AUTOTUNE_CONFIG['sample_rows'])
+        if not samples:
+            print("❌ Tidak ada baris VER='sesuai' dengan foto original di static/originals.")
+            return
+        best, _, report = autotune(samples, args.backend, args.warmup, args.min_accuracy)
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(best, f, indent=2)
+        print(f"🎉 Profil inferensi disimpan di {args.output}")
+    else:
+        models = app4.load_cascade_models(args.backend)
+        samples = app4.fetch_verified_samples(args.limit or 1000, ('sesuai', 'tidak'))
+        if not samples:
+            print("❌ Tidak ada baris terverifikasi dengan foto original di static/originals.")
+            return
+        report = run_benchmark(samples, models, args.warmup)
+    config = {'backend': args.backend, 'profiles': copy.deepcopy(app4.MODEL_PROFILES)}
+    print_report(report, config)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, **report}, f, indent=2)
+        print(f"✅ Laporan disimpan di {args.json_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+Pool proses worker untuk inferensi kaskade kwh -> stand -> ocr.
+
+Setiap proses worker memuat ketiga model sekali saat mulai (lihat inference_worker_spec di
+kwh_models), lalu menjalankan satu tahap kaskade per task. Gambar dikirim lewat shared memory:
+proses web menyalin semua gambar satu tahap ke satu blok SharedMemory, dan task hanya berisi
+nama blok serta offset/shape tiap gambar. Yang dikirim balik hanya keluaran tahap (dict kecil
+yang sama dengan isi STAGE_CACHE), bukan gambar.
+
+Modul ini sengaja tidak mengimpor app4 agar proses worker tidak ikut menjalankan inisialisasi
+aplikasi (Flask, database, model di proses web). Worker dibuat dengan start method spawn, bukan
+fork: proses web sudah punya thread lain (pipeline, job, lease) saat pool dibuat ulang, dan fork
+dari proses ber-thread bisa mewarisi lock yang sedang dipegang (deadlock), termasuk di worker
+gunicorn --preload. Karena itu spec harus bisa di-pickle (dict biasa).
+"""
+
+import os
+import math
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+STAGES = ('kwh', 'stand', 'ocr')
+
+# ==============================================================================
+# KELUARAN TAHAP KASKADE (DIPAKAI PROSES WEB DAN WORKER)
+# ==============================================================================
+
+def best_box(result):
+    # Ambil box dengan confidence tertinggi dari satu hasil YOLO
+    best, best_conf, best_cls = None, 0.0, None
+    if result and result.boxes:
+        for box in result.boxes:
+            conf = box.conf[0].item()
+            if conf > best_conf:
+                best_conf = conf
+                best_cls = int(box.cls[0].item())
+                best = list(map(int, box.xyxy[0]))
+    return best, best_conf, best_cls
+
+def stage_outputs(stage, names, results):
+    """
+    Mengubah hasil YOLO satu tahap menjadi dict keluaran per gambar (bisa di-pickle/JSON),
+    yang kemudian digabung ke dict deteksi oleh detect_batch.
+    """
+    outputs = []
+    for result in results:
+        if stage == 'kwh':
+            box, conf, cls = best_box(result)
+            outputs.append({'kwh_status': names[cls], 'kwh_conf': conf, 'kwh_box': box} if box is not None else {})
+        elif stage == 'stand':
+            box, conf, _ = best_box(result)
+            outputs.append({'stand_box': box, 'stand_conf': conf})
+        else:
+            digits = []
+            if result and result.boxes:
+                for box in result.boxes:
+                    digits.append({'bbox': list(map(int, box.xyxy[0])), 'class_name': names[int(box.cls[0].item())], 'confidence': box.conf[0].item()})
+            outputs.append({'digits': digits})
+    return outputs
+
+# ==============================================================================
+# SHARED MEMORY
+# ==============================================================================
+
+def pack_images(images):
+    """
+    Menyalin gambar (ndarray uint8) berurutan ke satu blok SharedMemory baru.
+
+    Returns:
+        tuple: (SharedMemory, layout) dengan layout = [(offset, shape), ...]. Pemanggil wajib
+        close() dan unlink() blok tersebut.
+    """
+    layout, offset = [], 0
+    for img in images:
+        layout.append((offset, img.shape))
+        offset += img.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=offset)
+    for img, (start, shape) in zip(images, layout):
+        np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=start)[...] = img
+    return shm, layout
+
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Blok dibuat dan dihapus oleh proses web; worker tidak boleh ikut melacak (dan menghapus) blok ini
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def unpack_images(name, layout):
+    # Salin gambar keluar dari shared memory agar blok bisa langsung ditutup (ultralytics menyimpan
+    # referensi ke gambar input terakhir di predictor)
+    shm = _attach_shared_memory(name)
+    try:
+        return [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset).copy() for offset, shape in layout]
+    finally:
+        shm.close()
+
+# ==============================================================================
+# PROSES WORKER
+# ==============================================================================
+
+_WORKER_MODELS = {}
+_WORKER_SPEC = {}
+
+def _init_worker(spec, torch_threads):
+    # Dijalankan sekali per proses worker: batasi thread torch/OpenMP lalu muat ketiga model
+    os.environ['OMP_NUM_THREADS'] = str(torch_threads)
+    # Worker spawn mewarisi resource tracker proses web; pakai tracker sendiri agar unregister di
+    # _attach_shared_memory tidak menghapus catatan blok milik proses web
+    resource_tracker._resource_tracker._fd = None
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    from ultralytics import YOLO
+    _WORKER_SPEC.update(spec)
+    for stage in STAGES:
+        _WORKER_MODELS[stage] = YOLO(spec['stages'][stage]['artifact'], task='detect')
+
+def _ping():
+    return os.getpid()
+
+def _run_stage_task(stage, shm_name, layout):
+    model = _WORKER_MODELS[stage]
+    images = unpack_images(shm_name, layout)
+    results = []
+    batch_size = _WORKER_SPEC['batch_size']
+    for start in range(0, len(images), batch_size):
+        results.extend(model(images[start:start + batch_size], **_WORKER_SPEC['stages'][stage]['predict']))
+    return stage_outputs(stage, model.names, results)
+
+# ==============================================================================
+# POOL DI PROSES WEB
+# ==============================================================================
+
+class InferencePool:
+    """
+    ProcessPoolExecutor berisi `processes` worker yang masing-masing memuat model sendiri.
+    run_stage aman dipanggil dari banyak thread sekaligus; satu panggilan dipecah menjadi
+    beberapa task agar gambar satu batch tersebar ke beberapa worker. Bila sebuah worker mati
+    (mis. OOM killer), pool dibuat ulang dengan spec yang sama dan tahap itu dicoba sekali lagi.
+
+    Args:
+        spec (dict): {'batch_size': int, 'stages': {tahap: {'artifact': path, 'predict': kwargs}}}
+        processes (int): Jumlah proses worker.
+        torch_threads (int): Jumlah thread torch/OpenMP per worker.
+        start_timeout (float): Batas detik menunggu worker selesai memuat model.
+    """
+
+    def __init__(self, spec, processes, torch_threads=1, start_timeout=300):
+        self.spec = spec
+        self.processes = processes
+        self.torch_threads = torch_threads
+        self.start_timeout = start_timeout
+        self._lock = threading.Lock()
+        self._executor = self._start_executor()
+
+    def _start_executor(self):
+        executor = ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(self.spec, self.torch_threads))
+        # Tunggu satu worker selesai memuat model agar error model langsung terlihat; dibatasi
+        # start_timeout agar worker yang macet tidak menahan _lock (dan semua request) selamanya
+        try:
+            executor.submit(_ping).result(timeout=self.start_timeout)
+        except BaseException:
+            # Worker yang masih memuat model tidak berhenti sendiri saat shutdown
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                process.terminate()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        return executor
+
+    def _restart(self, broken):
+        # Beberapa thread bisa melihat pool yang sama rusak; hanya yang pertama membuat pool baru
+        with self._lock:
+            if self._executor is broken:
+                print("⚠️ Proses worker inferensi mati, pool worker dibuat ulang.")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._start_executor()
+
+    def run_stage(self, stage, images):
+        """
+        Menjalankan satu tahap kaskade untuk list gambar (ndarray BGR) di proses worker.
+
+        Returns:
+            list[dict]: Keluaran tahap per gambar (format stage_outputs), urutan sama dengan input.
+        """
+        if not images:
+            return []
+        shm, layout = pack_images([np.ascontiguousarray(img, dtype=np.uint8) for img in images])
+        try:
+            return self.run_packed(stage, shm.name, layout)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def run_packed(self, stage, shm_name, layout):
+        # Seperti run_stage untuk gambar yang sudah ada di shared memory (hasil pack_images, mis. dari
+        # proses web lewat model_server); dipecah per task agar tersebar ke beberapa worker
+        executor = self._executor
+        try:
+            return self._run_chunks(executor, stage, shm_name, layout)
+        except BrokenProcessPool:
+            self._restart(executor)
+            return self._run_chunks(self._executor, stage, shm_name, layout)
+
+    def _run_chunks(self, executor, stage, shm_name, layout):
+        chunk_size = max(1, min(self.spec['batch_size'], math.ceil(len(layout) / self.processes)))
+        futures = [
+            executor.submit(_run_stage_task, stage, shm_name, layout[start:start + chunk_size])
+            for start in range(0, len(layout), chunk_size)
+        ]
+        outputs = []
+        for future in futures:
+            outputs.extend(future.result())
+        return outputs
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
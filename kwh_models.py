@@ -0,0 +1,251 @@
+"""
+Konfigurasi dan artefak model kaskade kwh -> stand -> ocr: path model, backend/presisi, profil
+inferensi, ekspor ONNX/OpenVINO, varian INT8, serta sidik (fingerprint) model per tahap.
+
+Dipakai app4 (proses web) dan model_server.py. Modul ini sengaja tidak punya efek samping
+selain membaca file profil inferensi: tidak membuka database, tidak membuat aplikasi Flask,
+dan tidak memuat ultralytics/torch (diimpor di dalam fungsi yang membutuhkannya).
+"""
+
+import os
+import json
+import hashlib
+
+# ==============================================================================
+# KONFIGURASI MODEL
+# ==============================================================================
+
+# Jumlah gambar maksimum per forward pass model (batch inference kaskade kwh -> stand -> ocr)
+INFERENCE_BATCH_SIZE = 16
+
+# File bobot model YOLO untuk kaskade deteksi kWh -> stand -> OCR angka
+MODEL_PATHS = {
+    'kwh': 'model/kwh.pt',
+    'stand': 'model/stand.pt',
+    'ocr': 'model/ocr.pt',
+}
+# Backend inferensi yang dipakai saat startup: 'pytorch' (file .pt), 'onnx' (ONNX Runtime, CPU)
+# atau 'openvino' (OpenVINO IR, CPU). Untuk onnx/openvino, file .pt diekspor sekali dan hasilnya
+# disimpan di samping file .pt (model/kwh.onnx, model/kwh_openvino_model/); ekspor diulang bila
+# file .pt lebih baru. Butuh paket onnxruntime atau openvino.
+INFERENCE_BACKEND = 'pytorch'
+# Presisi model: 'fp32' atau 'int8' (hanya untuk backend onnx/openvino). Varian INT8 dibuat dengan
+# quantize_models.py dan hanya dipakai untuk model yang lolos uji akurasi di file manifest;
+# model lain tetap memakai FP32.
+INFERENCE_PRECISION = 'fp32'
+# Profil inferensi per tahap kaskade: imgsz, conf, iou, max_det (None = bawaan model/ultralytics)
+# dan precision (None = INFERENCE_PRECISION). Isi INFERENCE_PROFILE_FILE (mis. hasil
+# `python benchmark.py --autotune`) menimpa nilai default ini saat startup.
+INFERENCE_PROFILE_FILE = 'model/inference_profiles.json'
+MODEL_PROFILES = {
+    'kwh': {'imgsz': None, 'conf': None, 'iou': None, 'max_det': None, 'precision': None},
+    'stand': {'imgsz': None, 'conf': None, 'iou': None, 'max_det': None, 'precision': None},
+    'ocr': {'imgsz': None, 'conf': None, 'iou': None, 'max_det': None, 'precision': None},
+}
+# Kuantisasi INT8: jumlah foto kalibrasi dari static/originals/<ket>, jumlah baris VER='sesuai'
+# untuk uji akurasi, dan penurunan kecocokan SAI maksimum (dibanding FP32) agar model INT8 diterima
+QUANTIZATION_CONFIG = {
+    'manifest': 'model/int8_manifest.json',
+    'calibration_dir': 'cache/calibration',
+    'calibration_images': 300,
+    'eval_rows': 1000,
+    'max_agreement_drop': 0.01,
+}
+
+# Inferensi di proses worker terpisah (inference_workers.py) agar semua core CPU terpakai:
+# 'processes' = jumlah proses worker, masing-masing memuat ketiga model sekali (0 = inferensi di
+# proses web seperti biasa), 'torch_threads' = thread torch/OpenMP per worker. Untuk server
+# 32 core mis. processes=16 dan torch_threads=2. Saat aktif, jumlah worker inferensi pipeline
+# minimal sama dengan 'processes'. 'start_timeout' = batas detik menunggu worker selesai memuat
+# model saat pool dibuat (atau dibuat ulang setelah worker mati).
+INFERENCE_WORKERS_CONFIG = {
+    'processes': 0,
+    'torch_threads': 1,
+    'start_timeout': 300,
+}
+
+# Model server terpisah (model_server.py) yang memegang model untuk semua worker web, mis. beberapa
+# worker gunicorn. Bila 'socket_path' diisi, proses web tidak memuat model maupun ultralytics/torch;
+# gambar dikirim ke model server lewat Unix socket + shared memory. Jalankan model server lebih dulu
+# (`python model_server.py`, jumlah prosesnya dari INFERENCE_WORKERS_CONFIG) dan restart setelah
+# mengganti model. None = model dimuat di proses web sendiri.
+MODEL_SERVER_CONFIG = {
+    'socket_path': None,
+    'timeout': 120,
+}
+
+# ==============================================================================
+# ARTEFAK MODEL, PROFIL, DAN SIDIK MODEL
+# ==============================================================================
+
+def exported_model_path(pt_path, backend):
+    # Lokasi artefak ekspor di samping file .pt, mengikuti penamaan ultralytics
+    base = os.path.splitext(pt_path)[0]
+    if backend == 'onnx':
+        return f"{base}.onnx"
+    if backend == 'openvino':
+        return f"{base}_openvino_model"
+    raise ValueError(f"Backend inferensi tidak dikenal: {backend}")
+
+def quantized_model_path(pt_path, backend):
+    # Lokasi varian INT8 hasil quantize_models.py
+    base = os.path.splitext(pt_path)[0]
+    if backend == 'onnx':
+        return f"{base}.int8.onnx"
+    if backend == 'openvino':
+        return f"{base}_int8_openvino_model"
+    raise ValueError(f"Backend inferensi tidak dikenal: {backend}")
+
+def _export_is_fresh(artifact, pt_path):
+    # Artefak OpenVINO berupa folder; yang dicek file .xml di dalamnya
+    if os.path.isdir(artifact):
+        xml_files = [name for name in os.listdir(artifact) if name.endswith('.xml')]
+        if not xml_files:
+            return False
+        artifact = os.path.join(artifact, xml_files[0])
+    return os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(pt_path)
+
+def load_quantization_manifest():
+    # {backend: {pt_path: {'accepted': bool, 'fp32_agreement': ..., 'int8_agreement': ..., ...}}}
+    try:
+        with open(QUANTIZATION_CONFIG['manifest'], encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def load_inference_profiles(path=INFERENCE_PROFILE_FILE):
+    """
+    Menimpa MODEL_PROFILES dengan isi file profil JSON ({tahap: {kunci: nilai}}), bila ada.
+    Tahap atau kunci yang tidak dikenal ditolak agar salah ketik tidak diam-diam diabaikan.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as f:
+        profiles = json.load(f)
+    for stage, profile in profiles.items():
+        if stage not in MODEL_PROFILES:
+            raise ValueError(f"Tahap tidak dikenal di {path}: {stage}")
+        unknown = set(profile) - set(MODEL_PROFILES[stage])
+        if unknown:
+            raise ValueError(f"Kunci profil tidak dikenal untuk {stage} di {path}: {', '.join(sorted(unknown))}")
+    for stage, profile in profiles.items():
+        MODEL_PROFILES[stage].update(profile)
+
+def predict_kwargs(stage):
+    # Argumen predict ultralytics dari profil tahap (yang bernilai None memakai bawaan)
+    profile = MODEL_PROFILES[stage]
+    return {key: profile[key] for key in ('imgsz', 'conf', 'iou', 'max_det') if profile.get(key) is not None}
+
+def _model_artifact(pt_path, backend, precision):
+    # Path yang dimuat load_model untuk backend/presisi ini (tanpa mengekspor apa pun)
+    if backend == 'pytorch':
+        return pt_path
+    if precision == 'int8':
+        quantized = quantized_model_path(pt_path, backend)
+        entry = load_quantization_manifest().get(backend, {}).get(pt_path, {})
+        if entry.get('accepted') and _export_is_fresh(quantized, pt_path):
+            return quantized
+    return exported_model_path(pt_path, backend)
+
+def stage_precision(stage):
+    return MODEL_PROFILES[stage]['precision'] or INFERENCE_PRECISION
+
+def prepare_model_artifact(pt_path, backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION):
+    """
+    Mengembalikan path model yang siap dimuat untuk backend dan presisi yang dipilih. Model
+    diekspor ke ONNX/OpenVINO hanya bila artefaknya belum ada atau lebih lama dari file .pt.
+    Dengan precision='int8', varian INT8 dipakai hanya bila tercatat lolos uji akurasi di
+    manifest kuantisasi dan dibuat dari file .pt yang sama; selain itu kembali ke FP32.
+    """
+    if backend == 'pytorch':
+        if precision == 'int8':
+            print("⚠️ INT8 hanya didukung backend onnx/openvino, memakai FP32.")
+        return pt_path
+    artifact = _model_artifact(pt_path, backend, precision)
+    if artifact == quantized_model_path(pt_path, backend):
+        return artifact
+    if precision == 'int8':
+        print(f"⚠️ Varian INT8 {pt_path} ({backend}) belum ada atau tidak lolos uji akurasi, memakai FP32.")
+    if not _export_is_fresh(artifact, pt_path):
+        from ultralytics import YOLO
+        print(f"🔧 Mengekspor {pt_path} ke {backend} (sekali saja)...")
+        # dynamic=True agar ukuran batch inferensi bisa berubah-ubah (lihat INFERENCE_BATCH_SIZE)
+        YOLO(pt_path).export(format=backend, dynamic=True)
+    return artifact
+
+def load_model(pt_path, backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION):
+    # Pra-proses dan NMS tetap dijalankan ultralytics, sehingga format hasil (Results/boxes)
+    # sama untuk semua backend. ultralytics diimpor di sini agar proses web yang memakai model
+    # server tidak ikut memuat ultralytics/torch.
+    from ultralytics import YOLO
+    return YOLO(prepare_model_artifact(pt_path, backend, precision), task='detect')
+
+def load_cascade_models(backend=INFERENCE_BACKEND, precision=None):
+    # Mengembalikan (kwh_model, stand_model, ocr_model). Tanpa precision, presisi tiap model
+    # diambil dari MODEL_PROFILES (atau INFERENCE_PRECISION bila profil tidak mengaturnya).
+    return tuple(load_model(MODEL_PATHS[name], backend, precision or stage_precision(name)) for name in ('kwh', 'stand', 'ocr'))
+
+def inference_worker_spec(backend=INFERENCE_BACKEND):
+    # Yang dibutuhkan proses worker inference_workers untuk memuat model dan menjalankan tiap tahap
+    return {
+        'batch_size': INFERENCE_BATCH_SIZE,
+        'stages': {
+            name: {
+                'artifact': prepare_model_artifact(MODEL_PATHS[name], backend, stage_precision(name)),
+                'predict': predict_kwargs(name),
+            }
+            for name in ('kwh', 'stand', 'ocr')
+        },
+    }
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _artifact_sha256(artifact):
+    # Isi artefak yang dimuat; artefak OpenVINO berupa folder, yang di-hash file .xml dan .bin-nya
+    if os.path.isdir(artifact):
+        files = sorted(name for name in os.listdir(artifact) if name.endswith(('.xml', '.bin')))
+        return hashlib.sha256(''.join(file_sha256(os.path.join(artifact, name)) for name in files).encode()).hexdigest()
+    if os.path.isfile(artifact):
+        return file_sha256(artifact)
+    return None  # Belum diekspor; diekspor dari .pt yang isinya sudah ikut di sidik
+
+def stage_fingerprints(backend=INFERENCE_BACKEND):
+    """
+    Sidik (fingerprint) per tahap kaskade: isi file .pt, isi artefak yang dimuat (backend dan
+    presisi, jadi kuantisasi ulang juga mengganti sidik), dan argumen predict tahap itu. Sidik ocr juga memuat sidik stand, karena input
+    OCR adalah potongan area stand. Keluaran tahap yang di-cache dengan sidik lain tidak
+    pernah dipakai, sehingga mengganti satu model hanya membuat cache tahap itu (dan tahap
+    yang bergantung padanya) tidak berlaku.
+
+    Returns:
+        dict: {'kwh': str, 'stand': str, 'ocr': str}
+    """
+    fingerprints = {}
+    for name in ('kwh', 'stand', 'ocr'):
+        pt_path = MODEL_PATHS[name]
+        artifact = _model_artifact(pt_path, backend, stage_precision(name))
+        parts = [name, os.path.basename(artifact), file_sha256(pt_path), predict_kwargs(name)]
+        if artifact != pt_path:
+            parts.append(_artifact_sha256(artifact))
+        if name == 'ocr':
+            parts.append(fingerprints['stand'])
+        fingerprints[name] = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+    return fingerprints
+
+def model_version(fingerprints):
+    # Versi kaskade secara keseluruhan (disimpan di kolom MODEL_VERSION); berubah bila sidik tahap mana pun berubah
+    return hashlib.sha256(json.dumps(fingerprints, sort_keys=True).encode()).hexdigest()[:16]
+
+# ==============================================================================
+# PROFIL INFERENSI DARI FILE (SAAT IMPOR)
+# ==============================================================================
+
+try:
+    load_inference_profiles()
+except (OSError, ValueError) as e:
+    print(f"⚠️ Profil inferensi {INFERENCE_PROFILE_FILE} tidak bisa dibaca, memakai default: {e}")
@@ -0,0 +1,236 @@
+"""
+Model server lokal: satu proses yang memegang model kwh, stand, dan ocr (lewat pool proses
+worker inference_workers) untuk semua worker web, sehingga menambah worker gunicorn tidak
+ikut menambah memori model.
+
+Worker web (app4 dengan MODEL_SERVER_CONFIG['socket_path'] di kwh_models.py terisi) tidak
+memuat model maupun ultralytics/torch. Gambar satu tahap kaskade ditulis ke shared memory, lalu
+yang dikirim lewat Unix socket hanya nama blok dan offset/shape tiap gambar. Balasannya
+keluaran tahap (JSON). Setiap permintaan membawa sidik model tahap dari proses web;
+permintaan dengan sidik yang berbeda (model diganti tetapi model server belum di-restart)
+ditolak agar hasil model lama tidak masuk ke cache atau tercatat dengan MODEL_VERSION baru.
+
+Protokol: setiap pesan = panjang 4 byte (big-endian) + JSON UTF-8.
+
+Contoh:
+    python model_server.py
+    python model_server.py --processes 16 --torch-threads 2
+"""
+
+import os
+import json
+import signal
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+
+import numpy as np
+
+import kwh_models
+from inference_workers import InferencePool, pack_images
+
+_HEADER = struct.Struct('!I')
+
+# ==============================================================================
+# PROTOKOL
+# ==============================================================================
+
+def send_message(sock, message):
+    payload = json.dumps(message).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError("Koneksi model server ditutup.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def recv_message(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size).decode('utf-8'))
+
+# ==============================================================================
+# CLIENT (DIPAKAI PROSES WEB)
+# ==============================================================================
+
+class ModelServerClient:
+    """
+    Pengganti InferencePool di proses web: run_stage mengirim gambar ke model server.
+    Aman dipakai banyak thread; koneksi Unix socket yang menganggur dipakai ulang.
+
+    Args:
+        socket_path (str): Path Unix socket model server.
+        fingerprints (dict): Sidik model per tahap di proses web (STAGE_FINGERPRINTS).
+        timeout (float): Batas waktu satu permintaan (detik).
+    """
+
+    def __init__(self, socket_path, fingerprints, timeout=120):
+        self.socket_path = socket_path
+        self.fingerprints = fingerprints
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._processes = None
+
+    def _acquire(self):
+        # (socket, dipakai_ulang): koneksi menganggur bila ada, selain itu koneksi baru
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise ConnectionError(f"Model server tidak bisa dihubungi di {self.socket_path}: {e}") from e
+        return sock
+
+    def _request(self, message):
+        sock, reused = self._acquire()
+        try:
+            try:
+                send_message(sock, message)
+                reply = recv_message(sock)
+            except (BrokenPipeError, ConnectionResetError, EOFError):
+                if not reused:
+                    raise
+                # Koneksi menganggur sudah ditutup server (mis. model server di-restart): coba sekali
+                # lagi dengan koneksi baru. Permintaan aman diulang karena tidak mengubah apa pun.
+                sock.close()
+                sock = self._connect()
+                send_message(sock, message)
+                reply = recv_message(sock)
+        except (OSError, EOFError, ValueError):
+            sock.close()  # Koneksi bisa dalam keadaan setengah jalan; jangan dipakai ulang
+            raise
+        with self._lock:
+            self._idle.append(sock)
+        if 'error' in reply:
+            raise RuntimeError(f"Model server: {reply['error']}")
+        return reply
+
+    def info(self):
+        return self._request({'op': 'info'})
+
+    @property
+    def processes(self):
+        # Jumlah proses worker di model server (1 bila model server belum bisa dihubungi)
+        if self._processes is None:
+            try:
+                self._processes = self.info()['processes']
+            except (ConnectionError, OSError, EOFError, RuntimeError):
+                return 1
+        return self._processes
+
+    def run_stage(self, stage, images):
+        # Antarmuka sama dengan InferencePool.run_stage
+        if not images:
+            return []
+        shm, layout = pack_images([np.ascontiguousarray(img, dtype=np.uint8) for img in images])
+        try:
+            reply = self._request({
+                'op': 'run_stage', 'stage': stage, 'fingerprint': self.fingerprints[stage],
+                'shm': shm.name, 'layout': layout,
+            })
+        finally:
+            shm.close()
+            shm.unlink()
+        return reply['outputs']
+
+    def close(self):
+        with self._lock:
+            for sock in self._idle:
+                sock.close()
+            self._idle.clear()
+
+# ==============================================================================
+# SERVER
+# ==============================================================================
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    # Satu thread per koneksi; satu koneksi melayani banyak permintaan berurutan
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (EOFError, OSError, ValueError):
+                return
+            try:
+                reply = self.server.dispatch(request)
+            except Exception as e:
+                print(f"❌ Error model server ({request.get('op')}): {e}")
+                reply = {'error': str(e)}
+            send_message(self.request, reply)
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool, fingerprints):
+        self.pool = pool
+        self.fingerprints = fingerprints
+        super().__init__(socket_path, _RequestHandler)
+
+    def dispatch(self, request):
+        if request.get('op') == 'info':
+            return {'processes': self.pool.processes, 'fingerprints': self.fingerprints, 'pid': os.getpid()}
+        if request.get('op') != 'run_stage':
+            return {'error': f"Operasi tidak dikenal: {request.get('op')}"}
+        stage = request['stage']
+        if request.get('fingerprint') != self.fingerprints.get(stage):
+            return {'error': f"Sidik model tahap {stage} berbeda dengan proses web; restart model server setelah mengganti model."}
+        layout = [(offset, tuple(shape)) for offset, shape in request['layout']]
+        return {'outputs': self.pool.run_packed(stage, request['shm'], layout)}
+
+def _stop_on_signal(signum, frame):
+    # SIGTERM (systemd, docker stop) diperlakukan seperti Ctrl+C agar socket dan pool ditutup rapi
+    raise KeyboardInterrupt
+
+def main():
+    # Hanya kwh_models yang diimpor (bukan app4): model server tidak membuka database, tidak
+    # membuat aplikasi Flask, dan tidak memuat model di luar pool worker
+    parser = argparse.ArgumentParser(description="Model server lokal untuk kaskade kwh -> stand -> ocr.")
+    parser.add_argument('--processes', type=int, default=max(1, kwh_models.INFERENCE_WORKERS_CONFIG['processes']))
+    parser.add_argument('--torch-threads', type=int, default=kwh_models.INFERENCE_WORKERS_CONFIG['torch_threads'])
+    args = parser.parse_args()
+
+    # Path socket sengaja hanya dari MODEL_SERVER_CONFIG agar worker web memakai path yang sama
+    socket_path = kwh_models.MODEL_SERVER_CONFIG['socket_path']
+    if not socket_path:
+        print("❌ MODEL_SERVER_CONFIG['socket_path'] di kwh_models.py belum diisi.")
+        return
+    try:
+        fingerprints = kwh_models.stage_fingerprints()
+    except OSError as e:
+        print(f"❌ File model tidak bisa dibaca, model server tidak dijalankan: {e}")
+        return
+    print(f"🔧 Memuat model di {args.processes} proses worker ({args.torch_threads} thread torch per worker)...")
+    pool = InferencePool(kwh_models.inference_worker_spec(), args.processes, args.torch_threads, kwh_models.INFERENCE_WORKERS_CONFIG['start_timeout'])
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # Socket sisa model server sebelumnya
+    server = ModelServer(socket_path, pool, fingerprints)
+    os.chmod(socket_path, 0o660)
+    signal.signal(signal.SIGTERM, _stop_on_signal)
+    print(f"✅ Model server berjalan di {socket_path} (versi model {kwh_models.model_version(fingerprints)}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        print("👋 Model server berhenti.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Kuantisasi INT8 (post-training) untuk model kwh, stand, dan ocr.
+
+Foto kalibrasi diambil dari static/originals/<ket>. Setiap model dikalibrasi dengan input
+yang benar-benar dilihatnya di kaskade: model kwh dan stand dengan foto utuh ('kwh_jelas'
+saja untuk stand), model ocr dengan potongan area stand hasil model stand FP32.
+
+Varian INT8 hanya diterima bila kecocokan SAI-nya terhadap baris VER = 'sesuai' tidak turun
+lebih dari max_agreement_drop dibanding FP32. Setiap model diuji terpisah (model lain tetap
+FP32), lalu semua model INT8 yang diterima diuji bersama dengan batas yang sama. Hasilnya dicatat di manifest (QUANTIZATION_CONFIG['manifest']), yang dibaca app4 saat
+INFERENCE_PRECISION = 'int8'.
+
+Contoh:
+    python quantize_models.py --backend onnx
+    python quantize_models.py --backend openvino --max-drop 0.005
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+
+import cv2
+import numpy as np
+
+# Tool ini memuat modelnya sendiri; model global app4 tidak perlu ikut dimuat
+os.environ.setdefault('KWH_SKIP_MODEL_LOAD', '1')
+import app4
+import kwh_models
+
+MODEL_NAMES = ('kwh', 'stand', 'ocr')
+
+def _model_imgsz(model):
+    # Ukuran input saat training (dipakai juga oleh ekspor ultralytics)
+    imgsz = model.model.args.get('imgsz', 640) if hasattr(model.model, 'args') else 640
+    return imgsz[0] if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+def collect_calibration_inputs(fp32_models, limit, seed=0):
+    """
+    Menyusun input kalibrasi per model dari static/originals/<ket>, dengan kaskade FP32.
+
+    Returns:
+        dict: {'kwh': [ndarray], 'stand': [ndarray], 'ocr': [ndarray]} (BGR).
+    """
+    originals_root = os.path.join('static', 'originals')
+    paths = []
+    if os.path.isdir(originals_root):
+        for ket in sorted(os.listdir(originals_root)):
+            folder = os.path.join(originals_root, ket)
+            if os.path.isdir(folder):
+                paths.extend(os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.lower().endswith('.jpg'))
+    random.Random(seed).shuffle(paths)
+
+    inputs = {name: [] for name in MODEL_NAMES}
+    for start in range(0, min(len(paths), limit), app4.INFERENCE_BATCH_SIZE):
+        images = [img for img in (cv2.imread(path) for path in paths[start:min(start + app4.INFERENCE_BATCH_SIZE, limit)]) if img is not None]
+        for img, det in zip(images, app4.detect_batch(images, fp32_models)):
+            inputs['kwh'].append(img)
+            if det['kwh_status'] != 'kwh_jelas':
+                continue
+            inputs['stand'].append(img)
+            if det['stand_box'] is not None:
+                sx1, sy1, sx2, sy2 = det['stand_box']
+                roi = img[sy1:sy2, sx1:sx2]
+                if roi.size:
+                    inputs['ocr'].append(roi)
+    return inputs
+
+def _letterbox_tensor(img, imgsz):
+    # Pra-proses yang sama dengan predictor ultralytics untuk model ONNX (letterbox persegi, RGB, 0..1)
+    from ultralytics.data.augment import LetterBox
+    padded = LetterBox((imgsz, imgsz), auto=False)(image=img)
+    return np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+
+def quantize_onnx(pt_path, images, imgsz):
+    """
+    Kuantisasi statis (QDQ, bobot INT8 per kanal) model ONNX FP32 hasil ekspor app4, dengan
+    onnxruntime.quantization. Metadata ultralytics (names, stride, imgsz) disalin ke model INT8.
+    """
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    fp32_path = app4.exported_model_path(pt_path, 'onnx')
+    int8_path = app4.quantized_model_path(pt_path, 'onnx')
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class LetterboxCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._feeds = ({input_name: _letterbox_tensor(img, imgsz)} for img in images)
+
+        def get_next(self):
+            return next(self._feeds, None)
+
+    quantize_static(fp32_path, int8_path, LetterboxCalibrationReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    fp32_model, int8_model = onnx.load(fp32_path), onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+    return int8_path
+
+def quantize_openvino(pt_path, name, images, names):
+    """
+    Kuantisasi INT8 OpenVINO (NNCF) lewat ekspor ultralytics. Foto kalibrasi ditulis ke
+    QUANTIZATION_CONFIG['calibration_dir']/<name> beserta data.yaml untuk ekspor.
+    """
+    from ultralytics import YOLO
+
+    dataset_dir = os.path.abspath(os.path.join(app4.QUANTIZATION_CONFIG['calibration_dir'], name))
+    image_dir = os.path.join(dataset_dir, 'images')
+    os.makedirs(image_dir, exist_ok=True)
+    for old in os.listdir(image_dir):
+        os.remove(os.path.join(image_dir, old))
+    for i, img in enumerate(images):
+        cv2.imwrite(os.path.join(image_dir, f"{i:05d}.jpg"), img)
+    data_yaml = os.path.join(dataset_dir, 'data.yaml')
+    with open(data_yaml, 'w', encoding='utf-8') as f:
+        # JSON adalah YAML yang valid
+        json.dump({'path': dataset_dir, 'train': 'images', 'val': 'images', 'names': names}, f)
+    YOLO(pt_path).export(format='openvino', int8=True, dynamic=True, data=data_yaml, fraction=1.0)
+    return app4.quantized_model_path(pt_path, 'openvino')
+
+def sai_agreement(models, samples):
+    # Fraksi sampel yang SAI hasil kaskade sama persis dengan SAI terverifikasi
+    if not samples:
+        return 0.0
+    matches = 0
+    for start in range(0, len(samples), app4.INFERENCE_BATCH_SIZE):
+        batch = samples[start:start + app4.INFERENCE_BATCH_SIZE]
+        images = [cv2.imread(sample['path']) for sample in batch]
+        valid = [(img, sample['sai']) for img, sample in zip(images, batch) if img is not None]
+        detections = app4.detect_batch([img for img, _ in valid], models)
+        matches += sum(app4.digits_to_sai(det['digits']) == sai for det, (_, sai) in zip(detections, valid))
+    return matches / len(samples)
+
+def gate_int8_cascade(backend_entries, fp32_models, samples, baseline, max_drop):
+    """
+    INFERENCE_PRECISION = 'int8' memuat semua model INT8 yang diterima sekaligus, sedangkan
+    setiap model diuji dengan dua model lain FP32. Kombinasi itu diuji lagi di sini; selama
+    kecocokan SAI-nya turun lebih dari max_drop, model INT8 dengan kecocokan terendah ditolak.
+    Hasil akhirnya dicatat di setiap entri manifest (cascade_agreement).
+    """
+    from ultralytics import YOLO
+
+    accepted = [
+        name for name in MODEL_NAMES
+        if backend_entries.get(app4.MODEL_PATHS[name], {}).get('accepted')
+        and kwh_models._export_is_fresh(backend_entries[app4.MODEL_PATHS[name]]['artifact'], app4.MODEL_PATHS[name])
+    ]
+    while accepted:
+        candidate = list(fp32_models)
+        for name in accepted:
+            candidate[MODEL_NAMES.index(name)] = YOLO(backend_entries[app4.MODEL_PATHS[name]]['artifact'], task='detect')
+        agreement = sai_agreement(tuple(candidate), samples)
+        if baseline - agreement <= max_drop:
+            print(f"✅ Kaskade INT8 ({', '.join(accepted)}) {agreement:.2%} vs FP32 {baseline:.2%}")
+            for name in accepted:
+                backend_entries[app4.MODEL_PATHS[name]]['cascade_agreement'] = round(agreement, 4)
+            return
+        weakest = min(accepted, key=lambda name: backend_entries[app4.MODEL_PATHS[name]]['int8_agreement'])
+        print(f"❌ Kaskade INT8 ({', '.join(accepted)}) {agreement:.2%} vs FP32 {baseline:.2%}, {weakest} INT8 ditolak")
+        backend_entries[app4.MODEL_PATHS[weakest]].update(accepted=False, cascade_agreement=round(agreement, 4))
+        accepted.remove(weakest)
+
+def main():
+    parser = argparse.ArgumentParser(description="Kuantisasi INT8 model kwh/stand/ocr dengan uji akurasi terhadap baris VER='sesuai'.")
+    parser.add_argument('--backend', choices=('onnx', 'openvino'), default=app4.INFERENCE_BACKEND if app4.INFERENCE_BACKEND != 'pytorch' else 'onnx')
+    parser.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=list(MODEL_NAMES))
+    parser.add_argument('--calibration-images', type=int, default=app4.QUANTIZATION_CONFIG['calibration_images'])
+    parser.add_argument('--eval-rows', type=int, default=app4.QUANTIZATION_CONFIG['eval_rows'])
+    parser.add_argument('--max-drop', type=float, default=app4.QUANTIZATION_CONFIG['max_agreement_drop'])
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+
+    print(f"🔧 Memuat model FP32 (backend: {args.backend})...")
+    fp32_models = app4.load_cascade_models(args.backend, 'fp32')
+    samples = app4.fetch_verified_samples(args.eval_rows)
+    if not samples:
+        print("❌ Tidak ada baris VER='sesuai' dengan foto original; uji akurasi tidak bisa dijalankan.")
+        return
+    print(f"🔧 Menyusun data kalibrasi dari static/originals (maks {args.calibration_images} foto)...")
+    calibration = collect_calibration_inputs(fp32_models, args.calibration_images)
+    baseline = sai_agreement(fp32_models, samples)
+    print(f"📊 Kecocokan SAI FP32: {baseline:.2%} dari {len(samples)} baris terverifikasi")
+
+    manifest = app4.load_quantization_manifest()
+    backend_entries = manifest.setdefault(args.backend, {})
+    for name in args.models:
+        index = MODEL_NAMES.index(name)
+        pt_path = app4.MODEL_PATHS[name]
+        if not calibration[name]:
+            print(f"⚠️ Tidak ada input kalibrasi untuk model {name}, dilewati.")
+            continue
+        print(f"🔧 Kuantisasi {name} dengan {len(calibration[name])} input kalibrasi...")
+        if args.backend == 'onnx':
+            artifact = quantize_onnx(pt_path, calibration[name], _model_imgsz(YOLO(pt_path)))
+        else:
+            artifact = quantize_openvino(pt_path, name, calibration[name], fp32_models[index].names)
+        # Uji model INT8 ini di dalam kaskade; dua model lain tetap FP32
+        candidate = list(fp32_models)
+        candidate[index] = YOLO(artifact, task='detect')
+        agreement = sai_agreement(tuple(candidate), samples)
+        accepted = baseline - agreement <= args.max_drop
+        backend_entries[pt_path] = {
+            'accepted': accepted,
+            'artifact': artifact,
+            'fp32_agreement': round(baseline, 4),
+            'int8_agreement': round(agreement, 4),
+            'max_agreement_drop': args.max_drop,
+            'eval_rows': len(samples),
+            'calibration_inputs': len(calibration[name]),
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        status = "✅ diterima" if accepted else "❌ ditolak"
+        print(f"{status}: {name} INT8 {agreement:.2%} vs FP32 {baseline:.2%} (batas turun {args.max_drop:.2%})")
+
+    # Model INT8 yang lolos sendiri-sendiri belum tentu lolos bila dipakai bersama
+    gate_int8_cascade(backend_entries, fp32_models, samples, baseline, args.max_drop)
+
+    os.makedirs(os.path.dirname(app4.QUANTIZATION_CONFIG['manifest']) or '.', exist_ok=True)
+    with open(app4.QUANTIZATION_CONFIG['manifest'], 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"🎉 Manifest kuantisasi disimpan di {app4.QUANTIZATION_CONFIG['manifest']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Proses ulang foto original (static/originals/<KET>/<IDPEL>_<BLTH>.jpg) dengan model yang
+sedang dipakai app4, misalnya setelah model diganti. SAI, KET, dan ANOTASI diperbarui dengan
+aturan upsert yang sama seperti download (VER tetap), dan foto dipindah ke folder KET barunya.
+
+Inkremental: baris yang MODEL_VERSION-nya sudah sama dengan versi model saat ini dilewati,
+sehingga aman dijadwalkan tiap malam, mis. lewat cron:
+    0 1 * * * cd /path/ke/app && python reprocess.py
+
+Contoh:
+    python reprocess.py
+    python reprocess.py --blth 202501 202502 --ket kwh_jelas
+    python reprocess.py --force
+"""
+
+import time
+import argparse
+from collections import Counter
+
+import app4
+
+def main():
+    parser = argparse.ArgumentParser(description="Proses ulang foto di static/originals dengan model saat ini.")
+    parser.add_argument('--blth', nargs='+', default=None, help='Hanya BLTH ini (default: semua)')
+    parser.add_argument('--ket', nargs='+', default=None, help='Hanya folder ket ini (default: semua)')
+    parser.add_argument('--force', action='store_true', help='Proses ulang walaupun sudah diproses versi model yang sama')
+    args = parser.parse_args()
+
+    if not app4.MODELS_LOADED:
+        print("❌ Model AI tidak berhasil dimuat, proses ulang dibatalkan.")
+        return
+    counts = Counter()
+
+    def on_result(task, result):
+        counts['gagal' if result.get('is_error') or not result.get('result_image_url') else 'berhasil'] += 1
+
+    def on_skip(reason):
+        counts[f"dilewati ({reason})"] += 1
+
+    print(f"🔧 Proses ulang static/originals dengan versi model {app4.MODEL_VERSION}...")
+    started = time.perf_counter()
+    app4.reprocess_originals(args.blth, args.ket, args.force, on_result=on_result, on_skip=on_skip)
+    elapsed = time.perf_counter() - started
+
+    print("\n📊 Hasil Proses Ulang")
+    print("---------------------------------")
+    for label, count in sorted(counts.items()):
+        print(f"{label:<36}: {count}")
+    print(f"{'Waktu':<36}: {elapsed:.1f} detik")
+    print("---------------------------------")
+
+if __name__ == '__main__':
+    main()